@@ -35,8 +35,8 @@ class Attribute(Node):
             result = False
         return result
 
-    def xmlrepr(self, parentInstance=None):
-        val = self.getValue()
+    def xmlrepr(self, value, parentInstance=None):
+        val = value
         if self.isOptional() and val == self.getDefaultValue():
             result = ''
         elif val is not None:
@@ -46,6 +46,15 @@ class Attribute(Node):
         result = utils.customUnicode(result, parentInstance._encoding)
         return result
 
+    def getComparableValue(self, value, parentInstance):
+        if self.isOptional() and value == self.getDefaultValue():
+            # not rendered
+            return None
+        if isinstance(value, (type(b''), type(u''))):
+            value = utils.customUnicode(value, parentInstance._encoding)
+            value = parentInstance.__escaper__(value)
+        return value
+
 class CDATAttribute(Attribute):
 
     def checkType(self, val):
@@ -106,12 +115,12 @@ class StringAttribute(CDATAttribute):
 
     """
 
-    def xmlrepr(self, parentInstance=None):
-        val = self.getValue()
+    def xmlrepr(self, value, parentInstance=None):
+        val = value
         if self.isOptional() and val == self.getDefaultValue():
             result = ''
         elif val is not None:
-            val = utils.replaceAll(val, parentInstance.getEntities())
+            val = parentInstance.__escaper__(val)
             result = '%s="%s"' % (self.getName(),val)
         else:
             result = ''
@@ -14,8 +14,6 @@
 # http://www.pythonware.com
 
 
-import string
-
 class CodeGeneratorBackend(object):
 
     def begin(self, tab="    "):
@@ -24,7 +22,7 @@ class CodeGeneratorBackend(object):
         self.level = 0
 
     def end(self):
-        return string.join(self.code, "")
+        return "".join(self.code)
 
     def write(self, string):
         toWrite = self.tab * self.level + string
@@ -48,3 +46,11 @@ class CodeGeneratorBackend(object):
             f = open(filename,'w')
             f.write( self.end() )
             f.close()
+
+    def compile(self, name, namespace):
+        """ Execute the generated code in `namespace`, used as globals,
+            and return the object it defined under `name`.
+        """
+        code = compile(self.end(), '<generated %s>' % name, 'exec')
+        exec(code, namespace)
+        return namespace[name]
@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2017 Doug Henderson <djndnbvg@gmail.com>
+# Copyright (C) 2004 Philippe Normand <phil@respyre.org>
+#
+# This file is part of EaseXML3 (http://easexml.base-art.net)
+#
+# Under PSF License (see COPYING)
+
+"""
+    Expat based parser backend.
+
+    `parse` builds XMLObjects directly from `xml.parsers.expat` events,
+    no DOM tree is built. Each XMLObject class has a `DispatchTable`
+    mapping the names of the XML elements its Nodes handle to these
+    Nodes. XML events are dispatched to builders, one per XML element
+    being parsed; builders give the Nodes the same values as their
+    `getValueFromDom` methods.
+
+    `iterParse` only builds the XMLObjects stored by one ListNode of
+    the document and yields them while parsing.
+"""
+
+from collections import deque
+from functools import partial
+from xml.parsers import expat
+
+from . Node import Node, RequiredNodeError
+from . Attributes import CDATAttribute, IntegerAttribute
+from . Nodes import CommentNode, TextNode, RawNode, ItemNode, ChoiceNode, ListNode
+from . TypedList import TypedList
+from . MixedList import MixedList
+from . import classregistry
+
+def _function(method):
+    return getattr(method, '__func__', method)
+
+# Node kinds known by the expat backend, keyed by the `getValueFromDom`
+# implementation they use
+KINDS = { _function(Node.getValueFromDom): 'none',
+          _function(CDATAttribute.getValueFromDom): 'attribute',
+          _function(IntegerAttribute.getValueFromDom): 'integer',
+          _function(CommentNode.getValueFromDom): 'comment',
+          _function(TextNode.getValueFromDom): 'text',
+          _function(RawNode.getValueFromDom): 'raw',
+          _function(ItemNode.getValueFromDom): 'item',
+          _function(ChoiceNode.getValueFromDom): 'choice',
+          _function(ListNode.getValueFromDom): 'list',
+          }
+
+class DispatchTable(object):
+    """ What the expat backend needs to know about an XMLObject class.
+
+        - ``nodes``: (attrName, node, kind) tuples, in `getNodes` order
+        - ``elements``: maps XML elements local names to the
+          (kind, attrName, class, parentName) tuples of the Nodes
+          handling them
+        - ``pcdata``: names of the ChoiceNodes accepting text
+    """
+
+    def __init__(self, cls):
+        registry = classregistry.registry(cls._registry)
+        self.generation = registry.generation
+        self.nodes = []
+        self.elements = {}
+        self.pcdata = []
+        for attrName, node in cls.__nodes__.iteritems():
+            kind = KINDS.get(_function(type(node).getValueFromDom))
+            if kind is None:
+                raise TypeError("%s.%s: %s can't be parsed by the expat backend" %
+                                (cls.__name__, attrName, type(node).__name__))
+            self.nodes.append((attrName, node, kind))
+            if kind == 'text':
+                self.add(node.getName(), kind, attrName)
+            elif kind in ('item', 'list'):
+                klass = registry.getClass(node.getItemType())
+                parentName = registry.getClass(node.getParentType()).getName()
+                self.add(klass.getName(), kind, attrName, klass, parentName)
+                if kind == 'list' and klass.getClassName() != klass.getName():
+                    # only used when no element is named after klass.getName()
+                    self.add(klass.getClassName(), 'list2', attrName, klass, parentName)
+            elif kind == 'choice':
+                if '#PCDATA' in node.alternatives:
+                    self.pcdata.append(attrName)
+                classes = node.getAlternativeClasses(cls._registry)
+                for name, klasses in classes.iteritems():
+                    for klass in klasses:
+                        self.add(name, kind, attrName, klass, node)
+
+    def add(self, name, kind, attrName, klass=None, extra=None):
+        self.elements.setdefault(name, []).append((kind, attrName, klass, extra))
+
+def getDispatchTable(cls):
+    """ Fetch the (cached) `DispatchTable` of an XMLObject class.
+    """
+    table = cls.__expatTable__
+    if table is None or \
+           table.generation != classregistry.registry(cls._registry).generation:
+        table = DispatchTable(cls)
+        cls.__expatTable__ = table
+    return table
+
+class Builder(object):
+    """ Receives the events of one XML element.
+
+        `startElement` returns the builders interested by a
+        sub-element. Others events are related to the element direct
+        content.
+    """
+
+    def startElement(self, localName, qName, attrs):
+        return []
+
+    def characters(self, data):
+        pass
+
+    def comment(self, data):
+        pass
+
+    def startCdata(self):
+        pass
+
+    def endCdata(self):
+        pass
+
+    def processingInstruction(self, target, data):
+        pass
+
+    def end(self):
+        pass
+
+class TextBuilder(Builder):
+    """ Collects the text of an XML element handled by a TextNode.
+    """
+
+    def __init__(self, done):
+        self.done = done
+        self.texts = []
+        self.inCdata = False
+
+    def characters(self, data):
+        if not self.inCdata:
+            self.texts.append(data)
+
+    def startCdata(self):
+        self.inCdata = True
+
+    def endCdata(self):
+        self.inCdata = False
+
+    def end(self):
+        if self.texts:
+            self.done(u''.join(self.texts))
+        else:
+            self.done(None)
+
+class ObjectBuilder(Builder):
+    """ Builds an XMLObject instance of class ``cls`` from an XML element.
+    """
+
+    def __init__(self, cls, qName, attrs, done):
+        self.table = getDispatchTable(cls)
+        self.xmlObject = cls._newEmpty()
+        self.stripStrings = cls._stripStrings
+        self.qName = qName
+        self.attrs = attrs
+        self.done = done
+        self.run = []
+        self.texts = []
+        self.comments = []
+        self.cdata = []
+        self.inCdata = False
+        # Nodes values collected from sub-elements, keyed by Node name
+        self.found = {}
+
+    def flush(self):
+        " end of a text node "
+        if not self.run:
+            return
+        text = u''.join(self.run)
+        self.run = []
+        self.texts.append(text)
+        if self.stripStrings:
+            text = text.strip()
+        if text:
+            for attrName in self.table.pcdata:
+                self.addChoice(attrName, text)
+
+    def addChoice(self, attrName, value):
+        self.found.setdefault(attrName, []).append(value)
+
+    def startElement(self, localName, qName, attrs):
+        self.flush()
+        builders = []
+        for kind, attrName, klass, extra in self.table.elements.get(localName, ()):
+            if kind == 'text':
+                found = self.found.setdefault(attrName, [])
+                builders.append(TextBuilder(found.append))
+            elif kind == 'choice':
+                if qName != klass.getName():
+                    continue
+                if not extra.isNoLimit() and self.found.get(attrName):
+                    continue
+                builders.append(ObjectBuilder(klass, qName, attrs,
+                                              partial(self.addChoice, attrName)))
+            else:
+                key = (kind, attrName)
+                found = self.found.setdefault(key, [])
+                if kind == 'item' and found:
+                    continue
+                # candidates not stored in an element named after the XMLObject
+                # owning the Node are counted, but not parsed
+                if self.qName != extra:
+                    found.append(None)
+                else:
+                    builders.append(ObjectBuilder(klass, qName, attrs, found.append))
+        return builders
+
+    def characters(self, data):
+        if self.inCdata:
+            self.cdata.append(data)
+        else:
+            self.run.append(data)
+
+    def comment(self, data):
+        self.flush()
+        self.comments.append(data)
+
+    def startCdata(self):
+        self.flush()
+        self.inCdata = True
+
+    def endCdata(self):
+        self.inCdata = False
+
+    def processingInstruction(self, target, data):
+        self.flush()
+
+    def strip(self, value):
+        if self.stripStrings:
+            value = value.strip()
+        return value
+
+    def getValue(self, attrName, node, kind):
+        """ Same as ``node.getValueFromDom`` """
+        value = None
+        if kind in ('attribute', 'integer'):
+            value = self.attrs.get(attrName)
+            if value is None:
+                if not node.isOptional():
+                    raise RequiredNodeError(node.getName())
+                value = node.getDefaultValue()
+            if value is not None:
+                value = self.strip(value)
+            if kind == 'integer' and value:
+                value = int(value)
+        elif kind in ('comment', 'raw'):
+            if kind == 'comment':
+                value = self.strip(u''.join(self.comments))
+            else:
+                value = self.strip(u''.join(self.cdata))
+            if value == '':
+                value = None
+        elif kind == 'text':
+            candidates = self.found.get(attrName)
+            if candidates is None:
+                if node.isMain():
+                    candidates = self.texts
+                elif not node.isOptional():
+                    raise RequiredNodeError(node.getName())
+            for text in candidates or ():
+                if text is not None:
+                    value = (value or u'') + text
+            if value is not None:
+                value = self.strip(value)
+        elif kind == 'item':
+            found = self.found.get(('item', attrName))
+            if not found and not node.isOptional():
+                raise RequiredNodeError(node.getName())
+            if found:
+                value = found[0]
+        elif kind == 'list':
+            value = TypedList(node)
+            found = self.found.get(('list', attrName)) or \
+                    self.found.get(('list2', attrName))
+            if not found and not node.isOptional():
+                raise RequiredNodeError(node.getName())
+            for xmlObject in found or ():
+                if xmlObject is not None:
+                    value.append(xmlObject)
+        elif kind == 'choice':
+            found = self.found.get(attrName, [])
+            if node.isNoLimit():
+                value = MixedList(node)
+                for item in found:
+                    value.append(item)
+            elif found:
+                value = found[0]
+        return value
+
+    def end(self):
+        self.flush()
+        for attrName, node, kind in self.table.nodes:
+            setattr(self.xmlObject, attrName, self.getValue(attrName, node, kind))
+        self.xmlObject._init()
+        self.done(self.xmlObject)
+
+class DocumentBuilder(Builder):
+    """ Builds the root XMLObject of a document. """
+
+    def __init__(self, cls):
+        self.cls = cls
+        self.result = None
+
+    def setResult(self, xmlObject):
+        self.result = xmlObject
+
+    def startElement(self, localName, qName, attrs):
+        return [ ObjectBuilder(self.cls, qName, attrs, self.setResult) ]
+
+class PathBuilder(Builder):
+    """ Follows a path of ItemNodes and ListNodes inside an XML element
+        without building its XMLObject.
+
+        ``steps`` are the names of the Nodes remaining on the path.
+        The XMLObjects stored by the last one are built and handed to
+        ``done``.
+    """
+
+    def __init__(self, cls, qName, steps, done):
+        self.table = getDispatchTable(cls)
+        self.qName = qName
+        self.steps = steps
+        self.done = done
+        self.found = {}
+
+    def startElement(self, localName, qName, attrs):
+        builders = []
+        for kind, attrName, klass, extra in self.table.elements.get(localName, ()):
+            if attrName != self.steps[0] or kind not in ('item', 'list', 'list2') \
+                   or self.qName != extra:
+                continue
+            if kind == 'item' and self.found.get(kind):
+                continue
+            if kind == 'list2' and self.found.get('list'):
+                continue
+            self.found[kind] = True
+            if len(self.steps) == 1:
+                builders.append(ObjectBuilder(klass, qName, attrs, self.done))
+            else:
+                builders.append(PathBuilder(klass, qName, self.steps[1:], self.done))
+        return builders
+
+class PathDocumentBuilder(Builder):
+    """ Follows a path from the root element of a document. """
+
+    def __init__(self, cls, steps, done):
+        self.cls = cls
+        self.steps = steps
+        self.done = done
+
+    def startElement(self, localName, qName, attrs):
+        return [ PathBuilder(self.cls, qName, self.steps, self.done) ]
+
+class ExpatHandler(object):
+    """ Dispatches expat events to the builders of the current element.
+    """
+
+    def __init__(self, documentBuilder):
+        self.stack = [ [documentBuilder] ]
+
+    def install(self, parser):
+        parser.StartElementHandler = self.startElement
+        parser.EndElementHandler = self.endElement
+        parser.CharacterDataHandler = self.characters
+        parser.CommentHandler = self.comment
+        parser.StartCdataSectionHandler = self.startCdata
+        parser.EndCdataSectionHandler = self.endCdata
+        parser.ProcessingInstructionHandler = self.processingInstruction
+
+    def splitName(self, name):
+        """ Return the (localName, qName) tuple of an expat name.
+
+            expat gives "uri localName prefix" for namespaced names.
+        """
+        parts = name.split(' ')
+        localName = qName = parts[len(parts) > 1]
+        if len(parts) == 3:
+            qName = u'%s:%s' % (parts[2], localName)
+        return localName, qName
+
+    def startElement(self, name, attrs):
+        localName, qName = self.splitName(name)
+        if attrs:
+            attrs = dict([ (self.splitName(key)[1], value)
+                           for key, value in attrs.iteritems() ])
+        builders = []
+        for builder in self.stack[-1]:
+            builders.extend(builder.startElement(localName, qName, attrs))
+        self.stack.append(builders)
+
+    def endElement(self, name):
+        for builder in self.stack.pop():
+            builder.end()
+
+    def characters(self, data):
+        for builder in self.stack[-1]:
+            builder.characters(data)
+
+    def comment(self, data):
+        for builder in self.stack[-1]:
+            builder.comment(data)
+
+    def startCdata(self):
+        for builder in self.stack[-1]:
+            builder.startCdata()
+
+    def endCdata(self):
+        for builder in self.stack[-1]:
+            builder.endCdata()
+
+    def processingInstruction(self, target, data):
+        for builder in self.stack[-1]:
+            builder.processingInstruction(target, data)
+
+def createParser(handler):
+    parser = expat.ParserCreate(namespace_separator=' ')
+    parser.namespace_prefixes = True
+    parser.buffer_text = True
+    handler.install(parser)
+    return parser
+
+def getPathSteps(cls, path):
+    """ Check that `path`, a '/' separated list of Node names, leads
+        from the XMLObject class `cls` to a ListNode through ItemNodes
+        and ListNodes.
+
+        Return the Node names list.
+    """
+    steps = path.split('/')
+    registry = classregistry.registry(cls._registry)
+    klass = cls
+    for i, attrName in enumerate(steps):
+        kinds = dict([ (name, kind) for name, node, kind
+                       in getDispatchTable(klass).nodes ])
+        kind = kinds.get(attrName)
+        if kind != 'list' and (kind != 'item' or i == len(steps) - 1):
+            raise ValueError("%r: %s.%s is not a %s" %
+                             (path, klass.__name__, attrName,
+                              i == len(steps) - 1 and 'ListNode' or
+                              'ListNode or an ItemNode'))
+        klass = registry.getClass(klass.__nodes__[attrName].getItemType())
+    return steps
+
+def iterParse(cls, source, path, chunkSize=65536):
+    """ Yield the XMLObjects stored by the ListNode reached by `path`
+        from the root XMLObject (of class `cls`) of `source`.
+
+        Only these XMLObjects are built, one at a time: the XMLObjects
+        along `path` are not, and no reference to the yielded ones is
+        kept. `source` is read and parsed by chunks of `chunkSize`
+        bytes.
+    """
+    steps = getPathSteps(cls, path)
+    pending = deque()
+    parser = createParser(ExpatHandler(PathDocumentBuilder(cls, steps,
+                                                           pending.append)))
+    if hasattr(source, 'read'):
+        read = source.read
+    else:
+        offset = [0]
+        def read(size):
+            data = source[offset[0]:offset[0] + size]
+            offset[0] += size
+            return data
+    while True:
+        data = read(chunkSize)
+        parser.Parse(data, not data)
+        while pending:
+            yield pending.popleft()
+        if not data:
+            break
+
+class _RootFound(Exception):
+    pass
+
+def getRootElementName(xmlData):
+    """ Local name of the root element of `xmlData`.
+
+        Parsing stops at the root element start tag. Unicode data is
+        parsed as is, whatever the encoding it declares.
+    """
+    def startElement(name, attrs):
+        parts = name.split(' ')
+        raise _RootFound(parts[len(parts) > 1])
+
+    if type(xmlData) == type(u''):
+        parser = expat.ParserCreate('utf-8', ' ')
+        xmlData = xmlData.encode('utf-8')
+    else:
+        parser = expat.ParserCreate(namespace_separator=' ')
+    parser.StartElementHandler = startElement
+    try:
+        for offset in range(0, len(xmlData), 4096):
+            parser.Parse(xmlData[offset:offset + 4096], False)
+        parser.Parse(b'', True)
+    except _RootFound as found:
+        return found.args[0]
+    return None
+
+def parse(cls, source):
+    """ Build an instance of the XMLObject class `cls` from `source`,
+        either XML data (a byte string) or a file-like object.
+
+        `xml.parsers.expat.ExpatError` is raised on malformed XML data.
+    """
+    documentBuilder = DocumentBuilder(cls)
+    parser = createParser(ExpatHandler(documentBuilder))
+    if hasattr(source, 'read'):
+        parser.ParseFile(source)
+    else:
+        parser.Parse(source, True)
+    return documentBuilder.result
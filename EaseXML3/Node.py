@@ -9,6 +9,8 @@
 
 import copy
 
+from . import utils
+
 class RequiredNodeError(Exception):
     """ A node is required.
 
@@ -17,7 +19,8 @@ class RequiredNodeError(Exception):
     """
 
     def __init__(self, name,xmlData=''):
-        Exception.__init__(self)
+        # arguments kept in `args` so that the exception can be pickled
+        Exception.__init__(self, name, xmlData)
         self._xml = xmlData
         self._msg = "'%s' node is not optional" % name
         if self._xml:
@@ -40,7 +43,9 @@ class Node(object):
         For each of these properties, there are getters and setters.
 
         * `xmlrepr` is the method responsible of giving a string representing
-          the node. User defined nodes should override it.
+          the node, given its value. User defined nodes should override it.
+        * `iterXmlRepr` gives the same representation as an iterator of
+          strings. It's the one used by the XMLObject serializers.
         * `getValueFromDom` is used to build a Node given its DOM tree.
         * `checkType` is responsible for node type checking during assignment.
           It returns True when assignment is legitim, False either.
@@ -111,16 +116,68 @@ class Node(object):
     def setParentType(self, parentType):
         self._parentType = parentType
 
-    def xmlrepr(self, parentInstance=None):
+    def xmlrepr(self, value, parentInstance=None, unwrapped=None):
         """ XML representation of the Node
 
-            Returns a string representing the Node as XML data.
+            Returns a string representing the Node holding ``value`` in
+            the ``parentInstance`` XMLObject, as XML data.
+
+            With ``unwrapped``, Nodes rendered inside a tag of their own
+            (``<name>...</name>``) only give the tag content. It
+            defaults to `isMain`: the content of a main Node is the
+            content of its XMLObject.
+
+            The same Node instance is shared by all the instances of an
+            XMLObject class, so the value has to be taken from the
+            arguments, never from the Node itself.
         """
         return ''
 
+    def iterXmlRepr(self, value, parentInstance=None, unwrapped=None):
+        """ XML representation of the Node holding ``value``
+
+            Yields unicode strings which, joined, give the Node XML
+            data. The default implementation yields the `xmlrepr`
+            result. Nodes storing XMLObjects override it so that
+            sub-trees are walked instead of being rendered at once.
+        """
+        if unwrapped is None:
+            # user defined Nodes may not know about rendering modes
+            yield self.xmlrepr(value, parentInstance=parentInstance)
+        else:
+            yield self.xmlrepr(value, parentInstance=parentInstance,
+                               unwrapped=unwrapped)
+
     def getValueFromDom(self, dom, attrName, **kw):
         return None
 
+    def getComparableValue(self, value, parentInstance):
+        """ Value of the Node compared by `XMLObject.__eq__`
+
+            Strings are decoded and escaped, and text gets stripped
+            when the ``parentInstance`` XMLObject strips strings on
+            import, so that strings giving the same XML data compare
+            equal.
+        """
+        if isinstance(value, (type(b''), type(u''))):
+            value = utils.customUnicode(value, parentInstance._encoding)
+            value = parentInstance.__escaper__(value)
+            if parentInstance._stripStrings:
+                value = value.strip()
+        return value
+
+    def getValueFingerprint(self, value, parentInstance):
+        """ Hash value of the Node holding ``value``, consistent with
+            `getComparableValue`.
+        """
+        value = self.getComparableValue(value, parentInstance)
+        try:
+            return hash(value)
+        except TypeError:
+            # lists
+            return hash(tuple([ self.getValueFingerprint(item, parentInstance)
+                                for item in value ]))
+
     def checkType(self, val):
         """ Type checking.
 
@@ -132,8 +189,16 @@ class Node(object):
         """
         return val
 
+    def getInitialValue(self):
+        """ Value given to the Node by a new XMLObject instance.
+
+            Nodes storing mutable values return a new object on each
+            call.
+        """
+        return self.getDefaultValue()
+
     def resetValue(self):
-        self.setValue(self.getDefaultValue())
+        self.setValue(self.getInitialValue())
 
     def setRegistry(self, reg):
         self._registry = reg
@@ -166,10 +231,10 @@ class ProcessingInstructionNode(Node):
         Node.__init__(self, **kw)
         self.name = name
 
-    def xmlrepr(self, parentInstance=None):
+    def xmlrepr(self, value, parentInstance=None):
         result = u'<?%s' % self.name
         values = u''
-        for key, val in self.getValue():
+        for key, val in value:
             values += u'%s="%s" ' % (key,val)
         if len(values):
             result += u' ' + values
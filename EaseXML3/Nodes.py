@@ -13,7 +13,7 @@ import string, copy
 # ProcessingInstructionNode is defined in Node to prevent recursive import between
 # main and this module.
 from . Node import Node, ProcessingInstructionNode, RequiredNodeError
-from . main import XMLObject
+from . main import XMLObject, isEmptyValue
 from . TypedList import TypedList
 from . MixedList import MixedList
 from . import classregistry, utils
@@ -22,10 +22,51 @@ __all__ = [ 'RawNode', 'TextNode', 'ItemNode', 'ChoiceNode',
             'ProcessingInstructionNode',
             'ListNode', 'CommentNode', 'LeftRecursionError' ]
 
+def getItemsFingerprint(value, parentInstance):
+    """ Hash value of the strings and XMLObjects held by a ListNode or
+        a ChoiceNode.
+
+        `XMLObject.__eq__` compares the XML data of such values when
+        their shapes differ, so single values count as lists of one
+        item, XMLObjects having a main Node value count as this value,
+        and adjacent strings are merged, whitespaces ignored.
+    """
+    items, texts = [], []
+
+    def addText():
+        text = u''.join(texts)
+        if text:
+            items.append(text)
+        del texts[:]
+
+    def addItems(value):
+        if value is None:
+            return
+        if isinstance(value, (list, TypedList)):
+            for item in value:
+                addItems(item)
+        elif isinstance(value, XMLObject):
+            mainValue = None
+            if value.__mainNode__ is not None:
+                mainValue = getattr(value, value.__mainNode__)
+            if not isEmptyValue(mainValue):
+                addItems(mainValue)
+            else:
+                addText()
+                items.append(value.fingerprint())
+        else:
+            text = utils.customUnicode(value, parentInstance._encoding)
+            texts.append(u''.join(parentInstance.__escaper__(text).split()))
+
+    addItems(value)
+    addText()
+    return hash(tuple(items))
+
 class LeftRecursionError(Exception):
 
     def __init__(self, msg):
-        Exception.__init__(self)
+        # argument kept in `args` so that the exception can be pickled
+        Exception.__init__(self, msg)
         self._msg = msg
 
     def __str__(self):
@@ -59,11 +100,20 @@ class CommentNode(Node):
         Node.__init__(self, optional=optional, main=main,
                       default=default, noLimit=False)
 
-    def xmlrepr(self, parentInstance=None):
-        value = self.getValue()
+    def getComparableValue(self, value, parentInstance):
+        if not value:
+            # not rendered
+            return None
+        # rendered as is: unlike text, not stripped
+        value = utils.customUnicode(value, parentInstance._encoding)
+        return parentInstance.__escaper__(value)
+
+    def xmlrepr(self, value, parentInstance=None, unwrapped=None):
+        if unwrapped is None:
+            unwrapped = self.isMain()
         if value and parentInstance:
-            value = utils.replaceAll(value, parentInstance.getEntities())
-            if not self.isMain():
+            value = parentInstance.__escaper__(value)
+            if not unwrapped:
                 value = "<!-- %s -->" % value
         else:
             value = ''
@@ -107,11 +157,12 @@ class TextNode(Node):
         Node.__init__(self, optional=optional, name=name, main=main,
                       default = default, noLimit=False)
 
-    def xmlrepr(self, parentInstance=None):
-        value = self.getValue()
+    def xmlrepr(self, value, parentInstance=None, unwrapped=None):
+        if unwrapped is None:
+            unwrapped = self.isMain()
         if value is not None and parentInstance:
-            value = utils.replaceAll(value, parentInstance.getEntities())
-            if not self.isMain():
+            value = parentInstance.__escaper__(value)
+            if not unwrapped:
                 value = "<%s>%s</%s>" % (self.getName(), value, self.getName())
         else:
             value = ''
@@ -120,14 +171,13 @@ class TextNode(Node):
 
     def getValueFromDom(self, dom, attrName, **kw):
         value = None
-        candidates = utils.getDirectChildrenWithName(dom,self.getName())
+        candidates = utils.getDirectChildrenWithName(dom,self.getName(),
+                                                     kw.get('children'))
         if len(candidates) == 0:
-            candidates = utils.getDirectChildrenWithName(dom,self.getName())
-            if len(candidates) == 0:
-                if self.isMain():
-                    candidates = [dom]
-                elif not self.isOptional():
-                    raise RequiredNodeError(self.getName(),dom.toxml())
+            if self.isMain():
+                candidates = [dom]
+            elif not self.isOptional():
+                raise RequiredNodeError(self.getName(),dom.toxml())
         for candidate in candidates:
             for node in candidate.childNodes:
                 if node.nodeType == node.TEXT_NODE:
@@ -161,8 +211,15 @@ class RawNode(Node):
         Node.__init__(self, optional=optional, main=main,
                       default = default, noLimit=False)
 
-    def xmlrepr(self, parentInstance=None):
-        value = self.getValue()
+    def getComparableValue(self, value, parentInstance):
+        if not value:
+            # not rendered
+            return None
+        # rendered as is: unlike text, not stripped
+        value = utils.customUnicode(value, parentInstance._encoding)
+        return parentInstance.__escaper__(value)
+
+    def xmlrepr(self, value, parentInstance=None, unwrapped=None):
         if value is None:
             value = ''
         if value != '':
@@ -215,27 +272,27 @@ class ItemNode(Node):
         Node.__init__(self, itemType=itemType, noLimit=False, main=main,
                       optional=optional, default=default)
 
-    def xmlrepr(self, parentInstance=None):
-        value = self.getValue()
+    def xmlrepr(self, value, parentInstance=None, unwrapped=None):
+        return u''.join(self.iterXmlRepr(value, parentInstance))
+
+    def iterXmlRepr(self, value, parentInstance=None, unwrapped=None):
         if value is not None:
-            value = value.toXml(headers=0, prettyPrint=False)
-        else:
-            value = ''
-        value = utils.customUnicode(value, parentInstance._encoding)
-        return value
+            for chunk in value._iterXml(headers=0):
+                yield chunk
 
     def getValueFromDom(self, dom, attrName, **kw):
         itemTypeName = self.getItemType()
         parentTypeName = self.getParentType()
-        xmlObject = classregistry.registry(kw['registry']).getClass(itemTypeName)()
+        klass = classregistry.registry(kw['registry']).getClass(itemTypeName)
         parentType = classregistry.registry(kw['registry']).getClass(parentTypeName)
-        candidates = utils.getDirectChildrenWithName(dom,xmlObject.getName())
+        candidates = utils.getDirectChildrenWithName(dom,klass.getName(),
+                                                     kw.get('children'))
         if len(candidates) == 0 and not self.isOptional():
             raise RequiredNodeError(self.getName())
         value = None
         for candidate in candidates:
             if candidate.parentNode.nodeName == parentType.getName():
-                value = xmlObject._fromDom(candidate)
+                value = klass._newEmpty()._fromDom(candidate)
                 break
         return value
 
@@ -269,6 +326,10 @@ class ChoiceNode(Node):
 
     def __init__(self, choiceAlternatives, optional=False, noLimit=False,main=False):
         self.alternatives = choiceAlternatives
+        # (registry generation, classes) cache of getAlternativeClasses
+        self._alternativeClasses = None
+        # cache of MixedList.getCheckPlan
+        self._checkPlan = None
         default = None
         if noLimit:
             default = MixedList(self)
@@ -289,11 +350,10 @@ Left recursivity detected in "%s" through "%s" attribute of "%s" """ %
                     if instance.getItemType()[0] == self.getParentType():
                         raise exc
 
-    def resetValue(self):
+    def getInitialValue(self):
         if self.isNoLimit():
-            self.setValue(MixedList(self))
-        else:
-            self.setValue(None)
+            return MixedList(self)
+        return None
 
     def setValue(self, value):
         if isinstance(value, ChoiceNode):
@@ -315,39 +375,66 @@ Left recursivity detected in "%s" through "%s" attribute of "%s" """ %
             result = False
         return result
 
-    def xmlrepr(self, parentInstance=None):
-        val = self.getValue()
-        result = ''
-        if val is not None:
-            if isinstance(val, MixedList) or type(val) == type([]):
-                for node in val:
-                    result += str(node)
-            elif isinstance(val, parentInstance.__class__):
-                result += val.toXml(headers=0, prettyPrint=False)
+    def xmlrepr(self, value, parentInstance=None, unwrapped=None):
+        return u''.join(self.iterXmlRepr(value, parentInstance))
+
+    def getValueFingerprint(self, value, parentInstance):
+        return getItemsFingerprint(value, parentInstance)
+
+    def iterXmlRepr(self, value, parentInstance=None, unwrapped=None):
+        if value is None:
+            return
+        if not (isinstance(value, MixedList) or type(value) == type([])):
+            value = [ value ]
+        for item in value:
+            if isinstance(item, XMLObject):
+                for chunk in item._iterXml(headers=0):
+                    yield chunk
             else:
-                result += str(val)
-        result = utils.customUnicode(result, parentInstance._encoding)
-        return result
+                yield utils.customUnicode(item, parentInstance._encoding)
+
+    def getAlternativeClasses(self, registryID):
+        """ Map XML element names to the XMLObject classes of the
+            alternatives handling them.
+
+            Classes are fetched from the class registry on first call,
+            and again each time a class is added to the registry.
+        """
+        registry = classregistry.registry(registryID)
+        cache = self._alternativeClasses
+        if cache is None or cache[0] != registry.generation:
+            classes = {}
+            for alt in self.alternatives:
+                try:
+                    klass = registry.getClass(alt)
+                except KeyError:
+                    continue
+                classes.setdefault(klass.getName(), []).append(klass)
+            cache = (registry.generation, classes)
+            self._alternativeClasses = cache
+        return cache[1]
 
     def getValueFromDom(self, dom, attrName, **kw):
         result = None
         if self.isNoLimit():
             result = MixedList(self)
 
+        classes = self.getAlternativeClasses(kw['registry'])
+        pcdata = '#PCDATA' in self.alternatives
         for childNode in dom.childNodes:
-            for alt in self.alternatives:
-                value = None
-                if alt == '#PCDATA':
-                    if childNode.nodeType == childNode.TEXT_NODE:
-                        value = childNode.data
-                        if kw['stripStrings']:
-                            value = value.strip()
-                try:
-                    xmlObject = classregistry.registry(kw['registry']).getClass(alt)()
-                    if childNode.nodeName == xmlObject.getName():
-                        value = xmlObject._fromDom(childNode)
-                except KeyError:
-                    pass
+            if childNode.nodeType == childNode.TEXT_NODE:
+                if not pcdata:
+                    continue
+                value = childNode.data
+                if kw['stripStrings']:
+                    value = value.strip()
+                values = [ value ]
+            elif childNode.nodeType == childNode.ELEMENT_NODE:
+                values = ( klass._newEmpty()._fromDom(childNode)
+                           for klass in classes.get(childNode.nodeName, ()) )
+            else:
+                continue
+            for value in values:
                 if not value:
                     continue
                 elif not self.isNoLimit():
@@ -386,6 +473,8 @@ class ListNode(Node):
     """
 
     def __init__(self, itemType, optional=True, main=False):
+        # cache of TypedList.getCheckPlan
+        self._checkPlan = None
         Node.__init__(self, itemType=itemType, main=main,
                       optional=optional, noLimit=True,
                       default = TypedList(self))
@@ -403,26 +492,30 @@ class ListNode(Node):
                 result = False
         return result
 
-    def xmlrepr(self, parentInstance=None):
-        result = ''
-        itemsNb = len(self.getValue())
+    def xmlrepr(self, value, parentInstance=None, unwrapped=None):
+        return u''.join(self.iterXmlRepr(value, parentInstance))
+
+    def getValueFingerprint(self, value, parentInstance):
+        return getItemsFingerprint(value, parentInstance)
+
+    def iterXmlRepr(self, value, parentInstance=None, unwrapped=None):
         registry = classregistry.registry(parentInstance._registry)
         parentClass = registry.getClass(self.getItemType())
         itemTypeName = parentClass.getName()
-        if itemsNb < 1 and not self.isOptional():
+        if len(value) < 1 and not self.isOptional():
             raise TypeError("Expected some node in '%s.%s' as it is not optional" %
                             (parentInstance.getName(),self.getName()))
-        for node in self.getValue():
-            nodeRepr = node.toXml(headers=0, prettyPrint=False)
-            if not isinstance(node, parentClass):
-                result += "<%s>%s</%s>" % (itemTypeName,nodeRepr,itemTypeName)
-            else:
-                result += nodeRepr
-        result = utils.customUnicode(result, parentInstance._encoding)
-        return result
-
-    def resetValue(self):
-        self.setValue(TypedList(self))
+        for node in value:
+            wrapped = not isinstance(node, parentClass)
+            if wrapped:
+                yield u'<%s>' % itemTypeName
+            for chunk in node._iterXml(headers=0):
+                yield chunk
+            if wrapped:
+                yield u'</%s>' % itemTypeName
+
+    def getInitialValue(self):
+        return TypedList(self)
 
     def getValueFromDom(self, dom, attrName, **kw):
         xmlList = TypedList(self)
@@ -430,13 +523,15 @@ class ListNode(Node):
         parentTypeName = self.getParentType()
         klass = classregistry.registry(kw['registry']).getClass(itemTypeName)
         parentType = classregistry.registry(kw['registry']).getClass(parentTypeName)
-        candidates = utils.getDirectChildrenWithName(dom,klass.getName())
+        candidates = utils.getDirectChildrenWithName(dom,klass.getName(),
+                                                     kw.get('children'))
         if len(candidates) == 0:
-            candidates = utils.getDirectChildrenWithName(dom,klass.getClassName())
+            candidates = utils.getDirectChildrenWithName(dom,klass.getClassName(),
+                                                         kw.get('children'))
         if len(candidates) == 0 and (not self.isOptional()):
             raise RequiredNodeError(self.getName(),dom.toxml())
         for xmlNode in candidates:
             if xmlNode.parentNode.nodeName == parentType.getName():
-                xmlObject = klass()
+                xmlObject = klass._newEmpty()
                 xmlList.append( xmlObject._fromDom(xmlNode) )
         return xmlList
@@ -30,107 +30,91 @@ class NoCallbackError(Exception):
     __repr__ = __str__
 
 class PrettyXMLPrinter(object):
-    regexps = [ ('processing_instruction', re.compile('<\?([^?]*)\?>')),
-                ('cdata', re.compile('<\!\[CDATA\[(.*\s*.*)\]\]>',re.DOTALL)),
-                ('comment', re.compile('<\!-- ([^<\-\-]*) -->')),
-                ('begin_tag', re.compile('<([-a-zA-Z0-9_]+)((\s+[-a-zA-Z0-9_]+=\\"[^"]*\\")*)(/)?>')),
-                ('end_tag', re.compile('</([-a-zA-Z0-9_]*)>') ),
-                ('content', re.compile('^[^<]')),
-                ]
-
-    def __init__(self):
-        self._reset()
-
-    def _reset(self):
-        self._tags = []
-
-    def _buildTag(self, tagName, attrs, alone=False):
-        tag = '<%s' % tagName
-        if attrs:
-            tag += attrs
-        if alone:
-            tag += '/'
-        tag += '>'
-        return tag
+    """ Indents XML data, one tag, comment, CDATA section or text
+        content per line.
+
+        The data is scanned once, from left to right: the scanner
+        keeps an offset in the string instead of slicing it. The
+        printer has no state, so a single one can be shared by several
+        XMLObjects, even from different threads.
+    """
+
+    piRe = re.compile(r'<\?([^?]*)\?>')
+    commentRe = re.compile(r'<\!-- ([^<\-\-]*) -->')
+    beginTagRe = re.compile(r'<([-a-zA-Z0-9_]+)((\s+[-a-zA-Z0-9_]+=\"[^"]*\")*)(/)?>')
+    endTagRe = re.compile(r'</([-a-zA-Z0-9_]*)>')
 
     def prettyPrint(self, stringToProcess, indent=' '):
-        result = ''
-        stringToProcess = stringToProcess.strip()
-        self._indent = indent
-        while stringToProcess:
-            backup = stringToProcess
-            for reName, regexp in self.regexps:
-                reResult = regexp.match(stringToProcess)
-                if reResult:
-                    callback = getattr(self, 'handle_%s' % reName)
-                    toAppend, stringToProcess = callback(stringToProcess,
-                                                         reResult.groups())
-                    result += toAppend
-                    break
-            if backup == stringToProcess:
-                self._reset()
-                raise NoCallbackError(stringToProcess)
-        self._reset()
-        return result[:-1]
-
-    def handle_processing_instruction(self, stringToProcess, reGroups):
-        " Processing Instruction "
-        content = reGroups[0]
-        pi = '<?%s?>' % content
-        stringToProcess = stringToProcess[len(pi):]
-        return pi + '\n', stringToProcess
-
-    def handle_comment(self, stringToProcess, reGroups):
-        " Comment "
-        content = '<!--%s-->' % reGroups[0]
-        end = stringToProcess.find('-->') + 3
-        result = self._indent * len(self._tags) + content + '\n'
-        stringToProcess = stringToProcess[end:]
-        return result, stringToProcess
-
-
-    def handle_begin_tag(self, stringToProcess, reGroups):
-        " Begin Tag "
-        tagName, attrs = reGroups[:2]
-        alone = reGroups[-1]
-        tag = self._buildTag(tagName, attrs, alone)
-        result = self._indent * len(self._tags) + tag + '\n'
-        stringToProcess = stringToProcess[len(tag):]
-        if not alone:
-            self._tags.append(tagName)
-        return result, stringToProcess
-
-    def handle_content(self, stringToProcess, reGroups):
-        " Element's content "
-        nextTagIndex = stringToProcess.find('<')
-        content = stringToProcess[:nextTagIndex]
-        result = ''
-        stringToProcess = stringToProcess[nextTagIndex:]
-        content = content.strip()
-        if content:
-            result = self._indent * (len(self._tags) + 1) + content + '\n'
-        return result, stringToProcess
-
-    def handle_cdata(self, stringToProcess, reGroups):
-        " CDATA section "
-        end = stringToProcess.find(']>') + 2
-        result = self._indent * len(self._tags) + stringToProcess[:end] + '\n'
-        stringToProcess = stringToProcess[end:]
-        return result, stringToProcess
-
-    def handle_end_tag(self, stringToProcess, reGroups):
-        " Closing Tag "
-        tagName = reGroups[0]
-        tag = '</%s>' % tagName
-        lastTag = self._tags[-1]
-        if lastTag == tagName:
-            self._tags = self._tags[:-1]
-        else:
-            self._reset()
-            raise NotWellFormedXML(tagName, lastTag)
-        result = self._indent * len(self._tags) + tag + '\n'
-        stringToProcess = stringToProcess[len(tag):]
-        return result, stringToProcess
+        return ''.join(self.iterPrettyPrint(stringToProcess, indent))[:-1]
+
+    def iterPrettyPrint(self, stringToProcess, indent=' ', depth=0, fragment=False):
+        """ Yield the lines of the pretty printed `stringToProcess`,
+            '\n' terminated.
+
+            `depth` is the indentation level of the data. A `fragment`
+            (the content of an element) may end with text.
+        """
+        data = stringToProcess.strip()
+        tags = [ None ] * depth
+        pos = 0
+        length = len(data)
+        while pos < length:
+            if data[pos] != '<':
+                # Element's content
+                nextTagIndex = data.find('<', pos)
+                if nextTagIndex == -1:
+                    if not fragment:
+                        raise NoCallbackError(data[-1:])
+                    nextTagIndex = length
+                content = data[pos:nextTagIndex].strip()
+                if content:
+                    yield indent * (len(tags) + 1) + content + '\n'
+                pos = nextTagIndex
+                continue
+
+            match = self.piRe.match(data, pos)
+            if match:
+                # Processing Instruction
+                yield match.group() + '\n'
+                pos = match.end()
+                continue
+
+            if data.startswith('<![CDATA[', pos) and data.find(']]>', pos + 9) != -1:
+                # CDATA section
+                end = data.find(']>', pos) + 2
+                yield indent * len(tags) + data[pos:end] + '\n'
+                pos = end
+                continue
+
+            match = self.commentRe.match(data, pos)
+            if match:
+                # Comment
+                yield indent * len(tags) + '<!--%s-->' % match.group(1) + '\n'
+                pos = match.end()
+                continue
+
+            match = self.beginTagRe.match(data, pos)
+            if match:
+                # Begin Tag
+                yield indent * len(tags) + match.group() + '\n'
+                if not match.group(4):
+                    tags.append(match.group(1))
+                pos = match.end()
+                continue
+
+            match = self.endTagRe.match(data, pos)
+            if match:
+                # Closing Tag
+                tagName = match.group(1)
+                lastTag = tags[-1]
+                if lastTag != tagName:
+                    raise NotWellFormedXML(tagName, lastTag)
+                tags.pop()
+                yield indent * len(tags) + match.group() + '\n'
+                pos = match.end()
+                continue
+
+            raise NoCallbackError(data[pos:])
 
 if __name__ == '__main__':
     import unittest
@@ -15,9 +15,25 @@ else:
 
 import copy
 
-from . main import XMLObject
+from . main import XMLObject, touch, addHolder, getHolders
 from . import classregistry
 
+def isAncestor(xmlObject, other):
+    """ Tell whether `xmlObject` is `other` or one of the XMLObjects
+        holding it, walking up the holders of `other` (see
+        `main.getHolders`).
+    """
+    stack = [ other ]
+    seen = set()
+    while stack:
+        current = stack.pop()
+        if current is xmlObject:
+            return True
+        if id(current) not in seen:
+            seen.add(id(current))
+            stack.extend(getHolders(current))
+    return False
+
 class TypedList(UserList):
     """ A *special* list implementation
 
@@ -41,72 +57,161 @@ class TypedList(UserList):
     def __init__(self, xmlList, data=[]):
         UserList.__init__(self, data)
         self._xmlList = xmlList
+        # the XMLObject holding the list, see `setOwner`
+        self._owner = None
+
+    def setOwner(self, xmlObject):
+        """ Set the XMLObject holding the list.
 
-    def walkOnXMLObject(self,xoName, registry, callback, *args, **kw):
-        theClass = classregistry.registry(registry).getClass(xoName)
+            Done when the list is assigned to one of the XMLObject
+            Nodes. The items the XMLObject descends from are replaced
+            by copies, see `makesCycle`.
+        """
+        self._owner = xmlObject
+        for index, it in enumerate(self.data):
+            if isinstance(it, XMLObject):
+                if self.makesCycle(it):
+                    it = copy.deepcopy(it)
+                    it.setParentNode(self._xmlList)
+                    self.data[index] = it
+                addHolder(it, xmlObject)
+                it._holder = xmlObject
+
+    def makesCycle(self, it):
+        """ Tell whether storing the `it` XMLObject would make the
+            XMLObject holding the list one of its own descendants.
+
+            Such items are copied, other ones are stored as is. The
+            XMLObjects holding the owner are walked up, those which
+            stored it before count too, so such an item may get copied
+            although the owner was since removed from it.
+        """
+        owner = self._owner
+        if owner is None:
+            # checked by setOwner
+            return False
+        return isAncestor(it, owner)
+
+    def addNestedNames(self, theClass, names):
+        """ Add to the `names` set the alternatives of the ChoiceNodes
+            of `theClass` and the types of its ListNodes and ItemNodes.
+
+            Items whose class name is found there are accepted as well,
+            strings too when '#PCDATA' is found.
+        """
         for nodeName, nodeInstance in theClass.__nodes__.iteritems():
             if nodeInstance.getType()  == 'ChoiceNode':
-                for classRef in nodeInstance.getItemType():
-                    if callback(classRef, *args, **kw):
-                        return True
+                names.update(nodeInstance.getItemType())
             elif nodeInstance.getType() in ['ListNode','ItemNode']:
-                if callback(nodeInstance.getType(), *args, **kw):
-                    return True
-        return False
+                names.add(nodeInstance.getType())
+
+    def makeCheckPlan(self, registry):
+        paClass = registry.getClass(self._xmlList.getItemType())
+        names = set()
+        self.addNestedNames(paClass, names)
+        pcdata = '#PCDATA' in names
+        if pcdata:
+            classes = (XMLObject,)
+        else:
+            classes = (paClass,)
+        return classes, frozenset(names), pcdata
 
-    def _compareTypes(self, itemType1, *args, **kw):
-        """ Callback used to compare two type names.
+    def getCheckPlan(self):
+        """ The (accepted classes, accepted class names, strings
+            accepted) plan of `checkItem`.
 
-            Used by `TypedList.walkOnXMLObject`
+            It is cached in the list Node, and computed again each
+            time a class is added to the registry.
         """
-        itemType2 = getattr(args[0],'__name__',args[0])
-        if itemType1 == '#PCDATA' and isinstance(itemType2, (type(b''), type(u''))):
-            itemType1 = itemType2
-        return itemType1 == itemType2
-
-
-    def checkItem(self, it):
-        parentType = self._xmlList.getItemType()
-        registry = self._xmlList.getRegistry()
-        paClass = classregistry.registry(registry).getClass(parentType)
-        typeMismatch = False
-        if isinstance(it, (type(b''), type(u''))):
-            if not self.walkOnXMLObject(parentType,
-                                        self._xmlList.getRegistry(),
-                                        self._compareTypes, it):
-                typeMismatch = True
-
-        elif not isinstance(it, XMLObject):
-            typeMismatch = True
-        #elif it.getClassName() != parentType and \
-        elif not isinstance(it, paClass) and \
-                 not self.walkOnXMLObject(parentType,
-                                          self._xmlList.getRegistry(),
-                                          self._compareTypes, it):
-            #print('humm')
-
-            #itClass = classregistry.registry(registry).getClass(it.getClassName())
-            #import pdb; pdb.set_trace()
+        registry = classregistry.registry(self._xmlList.getRegistry())
+        plan = self._xmlList._checkPlan
+        if plan is None or plan[0] != registry.generation:
+            plan = (registry.generation,) + self.makeCheckPlan(registry)
+            self._xmlList._checkPlan = plan
+        return plan[1:]
+
+    def checkItem(self, it, plan=None):
+        if plan is None:
+            plan = self.getCheckPlan()
+        classes, names, pcdata = plan
+        if isinstance(it, classes):
+            typeMismatch = False
+        elif isinstance(it, (type(b''), type(u''))):
+            typeMismatch = not pcdata and it not in names
+        elif isinstance(it, XMLObject):
+            typeMismatch = it.__name__ not in names
+        else:
             typeMismatch = True
 
         if typeMismatch:
-            #
             raise TypeError("""\
-%s type required for %s. Got %s instead""" % (repr(parentType),
+%s type required for %s. Got %s instead""" % (repr(self._xmlList.getItemType()),
                                               repr(self._xmlList.getName()),
                                               repr(type(it))))
         if isinstance(it,XMLObject):
-            if it.getClassName() == self._xmlList.getParentType():
+            if self.makesCycle(it):
                 it = copy.deepcopy(it)
+            addHolder(it, self._owner)
             it.setParentNode(self._xmlList)
+            it._holder = self._owner
+        touch(self._owner)
         return it
 
     def checkList(self, other):
+        """ Check all the items of `other` in one pass, return them
+            in a new list of the same kind.
+        """
         other2 = self.__class__(self._xmlList)
-        for it in other:
-            other2.append(it)
+        items = list(other)
+        if items:
+            plan = self.getCheckPlan()
+            other2.data = [ self.checkItem(it, plan) for it in items ]
         return other2
 
+    # other in place modifications, marking the owner dirty (see
+    # `touch`)
+
+    def __setitem__(self, i, item):
+        if isinstance(i, slice):
+            # extended slice
+            touch(self._owner)
+            item = self.checkList(item).data
+        else:
+            item = self.checkItem(item)
+        UserList.__setitem__(self, i, item)
+
+    def __delitem__(self, i):
+        touch(self._owner)
+        UserList.__delitem__(self, i)
+
+    def __setslice__(self, i, j, other):
+        touch(self._owner)
+        UserList.__setslice__(self, i, j, self.checkList(other))
+
+    def __delslice__(self, i, j):
+        touch(self._owner)
+        UserList.__delslice__(self, i, j)
+
+    def __imul__(self, n):
+        touch(self._owner)
+        return UserList.__imul__(self, n)
+
+    def pop(self, i=-1):
+        touch(self._owner)
+        return UserList.pop(self, i)
+
+    def remove(self, item):
+        touch(self._owner)
+        UserList.remove(self, item)
+
+    def reverse(self):
+        touch(self._owner)
+        UserList.reverse(self)
+
+    def sort(self, *args, **kw):
+        touch(self._owner)
+        UserList.sort(self, *args, **kw)
+
     def append(self, item):
         item = self.checkItem(item)
         UserList.append(self, item)
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2017 Doug Henderson <djndnbvg@gmail.com>
+# Copyright (C) 2004 Philippe Normand <phil@respyre.org>
+#
+# This file is part of EaseXML3 (http://easexml.base-art.net)
+#
+# Under PSF License (see COPYING)
+
+"""
+    Per-class compiled serializers.
+
+    `compileSerializer` writes, using a `CodeGeneratorBackend`, the
+    Python code of a generator function rendering instances of a given
+    XMLObject class. Tag and attribute names and entities escaping are
+    inlined in the generated code. Nodes the generator doesn't know
+    about (user-defined Nodes for instance) are rendered through their
+    `iterXmlRepr` method.
+
+    `compilePrettySerializer` does the same for pretty printed XML: the
+    lines are indented while they're generated, the way
+    `PrettyXMLPrinter` would indent them. Only the XML data of unknown
+    Nodes still goes through a `PrettyXMLPrinter`.
+"""
+
+import re
+
+from . CodeGeneratorBackend import CodeGeneratorBackend
+from . Node import ProcessingInstructionNode
+from . Attributes import Attribute, CDATAttribute, NMTokenAttribute, \
+     NMTokensAttribute, IntegerAttribute, StringAttribute
+from . Nodes import TextNode, CommentNode, RawNode, ItemNode, ListNode, ChoiceNode
+from . MixedList import MixedList
+from . PrettyXMLPrinter import PrettyXMLPrinter
+from . main import XMLObject
+from . import classregistry, utils
+
+# Attributes rendered without entities escaping
+PLAIN_ATTRIBUTES = (Attribute, CDATAttribute, NMTokenAttribute,
+                    NMTokensAttribute, IntegerAttribute)
+
+# tag and attribute names PrettyXMLPrinter knows about
+PRINTABLE_NAME = re.compile(r'[-a-zA-Z0-9_]+$')
+
+_printer = PrettyXMLPrinter()
+
+def prettyFragment(data, depth, indent):
+    """ Pretty print `data`, the content of an element at `depth` - 1.
+    """
+    return u''.join(_printer.iterPrettyPrint(data, indent, depth, fragment=True))
+
+def prettyLine(prefix, text):
+    """ Line of an element's text content, if any. """
+    text = text.strip()
+    if text:
+        return prefix + text + u'\n'
+    return u''
+
+def iterPrettyList(node, value, parentInstance, depth, indent):
+    """ Pretty printed chunks of a ListNode, one per item. """
+    registry = classregistry.registry(parentInstance._registry)
+    parentClass = registry.getClass(node.getItemType())
+    if len(value) < 1 and not node.isOptional():
+        raise TypeError("Expected some node in '%s.%s' as it is not optional" %
+                        (parentInstance.getName(), node.getName()))
+    for item in value:
+        if isinstance(item, parentClass):
+            yield u''.join(item._iterPrettyXml(0, depth, indent))
+        else:
+            prefix = indent * depth
+            name = parentClass.getName()
+            yield prefix + u'<%s>\n' % name + \
+                  u''.join(item._iterPrettyXml(0, depth + 1, indent)) + \
+                  prefix + u'</%s>\n' % name
+
+def iterPrettyChoice(value, encoding, depth, indent):
+    """ Pretty printed chunks of a ChoiceNode, one per XMLObject or
+        run of adjacent strings.
+    """
+    if value is None:
+        return
+    if not (isinstance(value, MixedList) or type(value) == type([])):
+        value = [ value ]
+    texts = []
+    for item in value:
+        if isinstance(item, XMLObject):
+            if texts:
+                yield prettyFragment(u''.join(texts), depth, indent)
+                texts = []
+            yield u''.join(item._iterPrettyXml(0, depth, indent))
+        else:
+            text = utils.customUnicode(item, encoding)
+            if text:
+                texts.append(text)
+    if texts:
+        yield prettyFragment(u''.join(texts), depth, indent)
+
+class SerializerCompiler(object):
+    """ Generates the serializer of one XMLObject class.
+
+        The generated function has the ``(self, headers)`` prototype and
+        yields unicode strings, just like `XMLObject._iterXml`. With
+        `pretty`, it has the ``(self, headers, depth, indent)`` prototype
+        of `XMLObject._iterPrettyXml` and yields whole lines.
+    """
+
+    def __init__(self, cls, pretty=False):
+        self.cls = cls
+        self.pretty = pretty
+        self.cog = CodeGeneratorBackend()
+        self.namespace = {'_decode': utils.customUnicode,
+                          '_bytes': type(b''),
+                          '_enc': cls._encoding,
+                          '_escape': cls.__escaper__,
+                          '_line': prettyLine,
+                          '_fragment': prettyFragment,
+                          '_prettyList': iterPrettyList,
+                          '_prettyChoice': iterPrettyChoice,
+                          }
+        self.entities = cls.__entities__
+
+    def bind(self, prefix, value):
+        """ Make `value` available to the generated code, return its name.
+        """
+        name = '_%s%d' % (prefix, len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def escape(self, expr):
+        return '_escape(%s)' % expr
+
+    def isPrintable(self, attrs, subNodes):
+        """ Can the lines be indented without scanning the rendered data ?
+
+            Escaped strings must not contain tags and all the names must
+            be known to `PrettyXMLPrinter`.
+        """
+        if '<' not in [ key for key, value in self.entities ] or \
+               [ value for key, value in self.entities if '<' in value ]:
+            return False
+        names = [ self.cls.getName() ] + \
+                [ node.getName() for attrName, node in attrs + subNodes ]
+        for name in names:
+            if not PRINTABLE_NAME.match(name):
+                return False
+        for attrName, node in attrs:
+            if type(node) not in PLAIN_ATTRIBUTES and type(node) is not StringAttribute:
+                return False
+        return True
+
+    def writeDecode(self):
+        self.cog.writeln('if type(v) is _bytes:')
+        self.cog.indent()
+        self.cog.writeln('v = _decode(v, _enc)')
+        self.cog.dedent()
+
+    def writeLeaf(self, attrName, node, target):
+        """ Write the code rendering a leaf `node`.
+
+            ``target`` is a format string turning the rendered unicode
+            expression into a statement. Return False if `node` is not
+            a known leaf.
+
+            In pretty mode, sub-nodes are rendered as whole lines, main
+            Nodes are still rendered as the element content.
+        """
+        cog = self.cog
+        pretty = self.pretty and not node.isMain()
+        key = '_XO_%s' % node.getName()
+        nodeType = type(node)
+        if nodeType in PLAIN_ATTRIBUTES or nodeType is StringAttribute:
+            n = self.bind('n', node)
+            cog.writeln('v = _get(%r)' % key)
+            cog.writeln('if v is not None and not (%s.isOptional() and '
+                        'v == %s.getDefaultValue()):' % (n, n))
+            cog.indent()
+            if nodeType is StringAttribute:
+                cog.writeln('v = %s' % self.escape('v'))
+            self.writeDecode()
+            cog.writeln(target % ('%r %% (v,)' % (u' %s="%%s"' % node.getName())))
+            cog.dedent()
+        elif nodeType is TextNode:
+            cog.writeln('v = _get(%r)' % key)
+            cog.writeln('if v is not None:')
+            cog.indent()
+            cog.writeln('v = %s' % self.escape('v'))
+            self.writeDecode()
+            tag = node.getName()
+            if node.isMain():
+                cog.writeln(target % 'v')
+            elif pretty:
+                cog.writeln(target % ('i1 + %r + _line(i3, v) + i1 + %r'
+                                      % (u'<%s>\n' % tag, u'</%s>\n' % tag)))
+            else:
+                cog.writeln(target % ('%r + v + %r' % (u'<%s>' % tag, u'</%s>' % tag)))
+            cog.dedent()
+        elif nodeType is CommentNode:
+            cog.writeln('v = _get(%r)' % key)
+            cog.writeln('if v:')
+            cog.indent()
+            cog.writeln('v = %s' % self.escape('v'))
+            self.writeDecode()
+            if node.isMain():
+                cog.writeln(target % 'v')
+            elif pretty:
+                cog.writeln(target % "i1 + u'<!--' + v + u'-->\\n'")
+            else:
+                cog.writeln(target % "u'<!-- ' + v + u' -->'")
+            cog.dedent()
+        elif nodeType is RawNode:
+            cog.writeln('v = _get(%r)' % key)
+            cog.writeln("if v is not None and v != '':")
+            cog.indent()
+            self.writeDecode()
+            if pretty:
+                cog.writeln(target % "i1 + u'<![CDATA[%s]]>\\n' % (v,)")
+            else:
+                cog.writeln(target % "u'<![CDATA[%s]]>' % (v,)")
+            cog.dedent()
+        else:
+            return False
+        return True
+
+    def writeChunks(self, attrName, node):
+        """ Write a loop over the chunks rendering a non-leaf `node`,
+            binding each of them to ``c``.
+
+            Return the indentation level to give back to `endChunks`.
+        """
+        cog = self.cog
+        nodeType = type(node)
+        if nodeType is ItemNode:
+            cog.writeln('v = _get(%r)' % ('_XO_%s' % node.getName()))
+            cog.writeln('if v is not None:')
+            cog.indent()
+            if self.pretty:
+                cog.writeln("for c in (u''.join(v._iterPrettyXml(0, depth + 1, indent)),):")
+            else:
+                cog.writeln('for c in v._iterXml(0):')
+            cog.indent()
+            return 2
+        n = self.bind('n', node)
+        key = '_XO_%s' % node.getName()
+        if not self.pretty:
+            cog.writeln('for c in %s.iterXmlRepr(_get(%r), self):'
+                        % (n, key))
+        elif nodeType is ListNode:
+            cog.writeln('for c in _prettyList(%s, _get(%r), self, '
+                        'depth + 1, indent):' % (n, key))
+        elif nodeType is ChoiceNode:
+            cog.writeln('for c in _prettyChoice(_get(%r), _enc, '
+                        'depth + 1, indent):' % key)
+        else:
+            cog.writeln("r = u''.join(%s.iterXmlRepr(_get(%r), self))"
+                        % (n, key))
+            cog.writeln('for c in (r and (_fragment(r, depth + 1, indent),) or ()):')
+        cog.indent()
+        return 1
+
+    def endChunks(self, level):
+        for i in range(level):
+            self.cog.dedent()
+
+    def writeOpen(self):
+        """ Write the code inserting the start tag in ``parts``, once """
+        cog = self.cog
+        cog.writeln('if not opened:')
+        cog.indent()
+        cog.writeln('opened = True')
+        if self.pretty:
+            cog.writeln("parts.insert(0, i0 + head + u'>\\n')")
+        else:
+            cog.writeln("parts.insert(0, head + u'>')")
+        cog.dedent()
+
+    def writeMain(self, attrName, node):
+        """ Write the code rendering the main `node` alone, when it's
+            not empty.
+
+            Main Nodes render the content of the XMLObject tag: they're
+            rendered unwrapped (see `Node.xmlrepr`).
+        """
+        cog = self.cog
+        name = self.cls.getName()
+        cog.writeln("r = u''")
+        leaf = self.writeLeaf(attrName, node, 'r = %s')
+        if not leaf:
+            n = self.bind('n', node)
+            cog.writeln('chunks = %s.iterXmlRepr(_get(%r), self)'
+                        % (n, '_XO_%s' % node.getName()))
+            cog.writeln('for r in chunks:')
+            cog.indent()
+            cog.writeln('if r:')
+            cog.indent()
+            cog.writeln('break')
+            cog.dedent()
+            cog.dedent()
+        cog.writeln('if r:')
+        cog.indent()
+        if not self.pretty:
+            if leaf:
+                cog.writeln("yield head + u'>' + r + %r" % (u'</%s>' % name))
+            else:
+                cog.writeln("yield head + u'>' + r")
+                cog.writeln('for c in chunks:')
+                cog.indent()
+                cog.writeln('yield c')
+                cog.dedent()
+                cog.writeln('yield %r' % (u'</%s>' % name))
+        elif leaf:
+            if type(node) is RawNode:
+                content = "i1 + r + u'\\n'"
+            else:
+                content = '_line(i2, r)'
+            cog.writeln("yield i0 + head + u'>\\n' + %s + i0 + %r"
+                        % (content, u'</%s>\n' % name))
+        else:
+            cog.writeln("yield i0 + head + u'>\\n'")
+            level = self.writeChunks(attrName, node)
+            cog.writeln('yield c')
+            self.endChunks(level)
+            cog.writeln('yield i0 + %r' % (u'</%s>\n' % name))
+        cog.writeln('return')
+        cog.dedent()
+
+    def compile(self):
+        cls, cog = self.cls, self.cog
+        name = cls.getName()
+        nodes = cls.__nodes__
+        nl = self.pretty and u'\n' or u''
+        i0 = self.pretty and 'i0 + ' or ''
+
+        pis = [ node for node in nodes.values()
+                if isinstance(node, ProcessingInstructionNode) ]
+        # undeclared names of the orders are skipped
+        attrs = [ (attrName, nodes[attrName])
+                  for attrName in cls._attrsOrder or nodes.keys()
+                  if attrName in nodes and
+                  isinstance(nodes[attrName], Attribute) ]
+        subNodes = [ (attrName, nodes[attrName])
+                     for attrName in cls._nodesOrder or nodes.keys()
+                     if attrName in nodes and
+                     not isinstance(nodes[attrName],
+                                    (Attribute, ProcessingInstructionNode)) ]
+        mainNodes = [ (attrName, node) for attrName, node in subNodes
+                      if node.isMain() ]
+
+        cog.begin()
+        if self.pretty:
+            cog.writeln("def serialize(self, headers=1, depth=0, indent=u' '):")
+            cog.indent()
+            if not self.isPrintable(attrs, subNodes):
+                cog.writeln("yield _fragment(u''.join(self._iterXml(headers)), "
+                            "depth, indent)")
+                cog.dedent()
+                return cog.compile('serialize', self.namespace)
+            cog.writeln('i0 = indent * depth')
+            cog.writeln('i1 = i0 + indent')
+            cog.writeln('i2 = i1 + indent')
+            cog.writeln('i3 = i2 + indent')
+        else:
+            cog.writeln('def serialize(self, headers=1):')
+            cog.indent()
+        if cls._compact:
+            cog.writeln('_get = self.get')
+        else:
+            cog.writeln('_get = self._attributes.get')
+        if pis:
+            cog.writeln('if headers:')
+            cog.indent()
+            for node in pis:
+                pi = self.bind('pi', node)
+                cog.writeln('yield %s.xmlrepr(%s.getValue()) + %r' % (pi, pi, nl))
+            cog.dedent()
+
+        # XMLObject tag attributes
+        cog.writeln('head = %r' % (u'<%s' % name))
+        for attrName, node in attrs:
+            if not self.writeLeaf(attrName, node, 'head += %s'):
+                n = self.bind('n', node)
+                cog.writeln("r = u''.join(%s.iterXmlRepr(_get(%r), self))"
+                            % (n, '_XO_%s' % node.getName()))
+                cog.writeln('if r:')
+                cog.indent()
+                cog.writeln("head += u' ' + r")
+                cog.dedent()
+
+        # the main Node, when not empty, is the only one rendered
+        if mainNodes:
+            self.writeMain(*mainNodes[-1])
+
+        # XMLObject sub-tags
+        cog.writeln('parts = []')
+        cog.writeln('opened = False')
+        for attrName, node in subNodes:
+            if mainNodes and node is mainNodes[-1][1]:
+                # known to be empty at this point
+                continue
+            if self.writeLeaf(attrName, node, 'parts.append(%s)'):
+                continue
+            level = self.writeChunks(attrName, node)
+            if not self.pretty:
+                # pretty chunks are all significant, even empty ones
+                cog.writeln('if c:')
+                cog.indent()
+                level += 1
+            self.writeOpen()
+            cog.writeln('if parts:')
+            cog.indent()
+            cog.writeln("yield u''.join(parts)")
+            cog.writeln('del parts[:]')
+            cog.dedent()
+            cog.writeln('yield c')
+            self.endChunks(level)
+
+        close = u'</%s>%s' % (name, nl)
+        cog.writeln('if opened:')
+        cog.indent()
+        cog.writeln("yield u''.join(parts) + %s%r" % (i0, close))
+        cog.dedent()
+        cog.writeln('elif parts:')
+        cog.indent()
+        cog.writeln("yield %shead + %r + u''.join(parts) + %s%r"
+                    % (i0, u'>' + nl, i0, close))
+        cog.dedent()
+        cog.writeln('else:')
+        cog.indent()
+        cog.writeln("yield %shead + %r" % (i0, u'/>' + nl))
+        cog.dedent()
+        cog.dedent()
+
+        return cog.compile('serialize', self.namespace)
+
+def compileSerializer(cls):
+    """ Build the serializer function of the XMLObject class `cls`.
+    """
+    return SerializerCompiler(cls).compile()
+
+def compilePrettySerializer(cls):
+    """ Build the pretty printing serializer function of the XMLObject
+        class `cls`.
+    """
+    return SerializerCompiler(cls, pretty=True).compile()
@@ -56,6 +56,12 @@ class ClassRegistry(object):
         self.name = name
         self.classes = {}
         self.callbacks = {}
+        # classes keyed by the name of the XML elements they handle,
+        # latest added last
+        self.elementNames = {}
+        # bumped each time a class is added, so that data computed
+        # from the registry content can be cached
+        self.generation = 0
 
     def addClassCallback(self, className, callback, *args, **kw):
         """
@@ -75,15 +81,54 @@ class ClassRegistry(object):
         that other classes can find it by name.  We also call any
         callbacks that are waiting for the class.
         """
+        previous = self.classes.get(cls.__name__)
+        if previous is not None:
+            self._removeElementName(previous)
         self.classes[cls.__name__] = cls
+        self._addElementName(cls)
+        self.generation += 1
         if cls.__name__ in self.callbacks:
             for callback, args, kw in self.callbacks[cls.__name__]:
                 callback(cls, *args, **kw)
             del self.callbacks[cls.__name__]
 
+    def _elementName(self, cls):
+        """
+        Name of the elements handled by `cls`: the result of its
+        ``getName`` method when it has a valid one, its name otherwise.
+        """
+        getName = getattr(cls, 'getName', None)
+        if getName is None:
+            return cls.__name__
+        try:
+            return getName()
+        except ValueError:
+            return None
+
+    def _addElementName(self, cls):
+        name = self._elementName(cls)
+        if name is not None:
+            self.elementNames.setdefault(name, []).append(cls)
+
+    def _removeElementName(self, cls):
+        name = self._elementName(cls)
+        classes = self.elementNames.get(name, [])
+        if cls in classes:
+            classes.remove(cls)
+            if not classes:
+                del self.elementNames[name]
+
     def getClass(self, className):
         return self.classes[className]
 
+    def getClassForElement(self, elementName):
+        """
+        Fetch the class handling `elementName` elements, the latest
+        added one if there are several. Raise KeyError when there is
+        none.
+        """
+        return self.elementNames[elementName][-1]
+
     def allClasses(self):
         return self.classes.values()
 
@@ -7,11 +7,16 @@
 # Under PSF License (see COPYING)
 
 
-import sys, re, types, string, copy
+import sys, re, types, string, copy, weakref, pickle
 
 if sys.version_info[:2] < (2,2):
     raise RuntimeError('EaseXML3 is not compatible with Python versions prior to 2.2')
 
+if sys.version_info[0] < 3:
+    from UserList import UserList
+else:
+    from collections import UserList
+
 # xml.minidom is only used to parse incoming XML
 # when building XMLObject from string data
 from xml.dom.minidom import parseString
@@ -23,13 +28,284 @@ from . import classregistry
 from . import utils
 from . Node import Node, ProcessingInstructionNode
 from . Attributes import Attribute
-from . PrettyXMLPrinter import PrettyXMLPrinter
 from . Namespace import getAllNamespaces
+from . PrettyXMLPrinter import PrettyXMLPrinter
 
 __all__ = [ 'XMLObject', 'ParseError']
 
 XML_PI = 'xmlProcessingInstruction'
 
+# the dummy parent Node of the XMLObjects not stored by another one
+NO_PARENT = Node()
+
+# instance attributes which `XMLObject.__reduce_ex__` doesn't pickle:
+# Node values, rebuilt by `restoreXMLObject`, and cached data
+RESTORED_ATTRIBUTES = frozenset([ '_attributes', '_parentNode', '_holder',
+                                  '_sharedHolders', '_dirty', '_fingerprint',
+                                  '_xmlCache', XML_PI ])
+
+def getHolder(xmlObject):
+    """ The XMLObject holding `xmlObject` in one of its Nodes, if any. """
+    parent = xmlObject._parentNode
+    if isinstance(parent, XMLObject):
+        return parent
+    # {Typed,Mixed}List item, whose parent is the list Node
+    return getattr(xmlObject, '_holder', None)
+
+def getHolders(xmlObject):
+    """ All the XMLObjects which stored `xmlObject` (see `addHolder`). """
+    holders = []
+    holder = getHolder(xmlObject)
+    if holder is not None:
+        holders.append(holder)
+    shared = getattr(xmlObject, '_sharedHolders', None)
+    if shared:
+        holders.extend(shared.values())
+    return holders
+
+def shareHolder(xmlObject, holder):
+    """ Record that `holder` stores `xmlObject` too, besides the
+        XMLObject its parent links point to.
+
+        The other holders are kept by id in a weak dictionnary, only
+        created for the XMLObjects stored several times: XMLObjects
+        hash by content (see `XMLObject.fingerprint`).
+    """
+    shared = getattr(xmlObject, '_sharedHolders', None)
+    if shared is None:
+        shared = xmlObject._sharedHolders = weakref.WeakValueDictionary()
+    shared[id(holder)] = holder
+
+def addHolder(xmlObject, holder):
+    """ Record that `holder` stores `xmlObject`, before the parent links
+        of `xmlObject` get pointed at it: the XMLObject they pointed to
+        stays one of its holders (see `touch`).
+    """
+    old = getHolder(xmlObject)
+    if old is not None and old is not holder:
+        shareHolder(xmlObject, old)
+
+def isDirty(xmlObject):
+    """ Tell whether `xmlObject` was modified since its XML data or
+        fingerprint were last cached.
+    """
+    try:
+        return xmlObject._dirty
+    except AttributeError:
+        # unset compact XMLObject slot: nothing cached yet
+        return True
+
+def touch(xmlObject):
+    """ Record a modification of `xmlObject`, done through its
+        MetaAttributes or {Typed,Mixed}Lists: it and the XMLObjects
+        holding it, up to the root of the tree, get marked dirty and
+        drop their cached XML data (see `XMLObject._cacheXml`) and
+        fingerprint (see `XMLObject.fingerprint`).
+
+        All the XMLObjects which stored `xmlObject` are walked, see
+        `addHolder`. The walk stops at the XMLObjects already dirty,
+        whose holders are dirty too.
+    """
+    stack = [ xmlObject ]
+    while stack:
+        current = stack.pop()
+        if isDirty(current):
+            continue
+        current._dirty = True
+        current._xmlCache = None
+        current._fingerprint = None
+        stack.extend(getHolders(current))
+
+def markClean(xmlObject):
+    """ Mark `xmlObject` and the dirty XMLObjects of its tree clean,
+        once the data cached by `xmlObject` got computed again.
+    """
+    stack = [ xmlObject ]
+    while stack:
+        current = stack.pop()
+        current._dirty = False
+        klass = current.__class__
+        for attr in klass.__childAttributes__:
+            value = attr.__get__(current, klass)
+            if isinstance(value, XMLObject):
+                if isDirty(value):
+                    stack.append(value)
+            elif isinstance(value, UserList):
+                stack.extend([ item for item in value.data
+                               if isinstance(item, XMLObject)
+                               and isDirty(item) ])
+
+# types of the Node values which aren't XMLObjects or lists
+LEAF_TYPES = frozenset([ type(None), type(b''), type(u''), int, long, float, bool ])
+
+def isEmptyValue(value):
+    """ Is `value` a Node value rendered as an empty string ? """
+    if isinstance(value, (list, UserList)):
+        for item in value:
+            if isinstance(item, XMLObject) or item:
+                return False
+        return True
+    return value is None or (not isinstance(value, XMLObject) and value == '')
+
+def sameNodeValues(node, value1, xmlObject1, value2, xmlObject2):
+    """ Compare the values of `node` in two XMLObjects, recursively for
+        the XMLObjects they hold.
+
+        Values of different shapes (XMLObjects of different types, a
+        list and a single value, ...) may still give the same XML
+        data: their XML representations are compared.
+    """
+    if value1 is value2:
+        return True
+    if type(value1) in LEAF_TYPES and type(value2) in LEAF_TYPES:
+        if type(value1) is type(value2) and value1 == value2:
+            return True
+        return node.getComparableValue(value1, xmlObject1) == \
+               node.getComparableValue(value2, xmlObject2)
+    isList1 = isinstance(value1, (list, UserList))
+    isList2 = isinstance(value2, (list, UserList))
+    if isList1 and isList2:
+        if len(value1) != len(value2):
+            strings = [ item for item in list(value1) + list(value2)
+                        if not isinstance(item, XMLObject) ]
+            if strings:
+                # adjacent strings are merged in XML data
+                return sameNodeXml(node, value1, xmlObject1, value2, xmlObject2)
+            return False
+        for item1, item2 in zip(value1, value2):
+            if not sameNodeValues(node, item1, xmlObject1, item2, xmlObject2):
+                if isinstance(item1, XMLObject) and isinstance(item2, XMLObject) \
+                       and item1.getName() != item2.getName():
+                    # one of them may be wrapped in a ListNode item
+                    if sameNodeXml(node, [item1], xmlObject1, [item2], xmlObject2):
+                        continue
+                return False
+        return True
+    if isList1 or isList2:
+        return sameNodeXml(node, value1, xmlObject1, value2, xmlObject2)
+    if isinstance(value1, XMLObject) or isinstance(value2, XMLObject):
+        return isinstance(value1, XMLObject) and \
+               isinstance(value2, XMLObject) and value1 == value2
+    if type(value1) is type(value2) and value1 == value2:
+        return True
+    return node.getComparableValue(value1, xmlObject1) == \
+           node.getComparableValue(value2, xmlObject2)
+
+def itemToDict(item):
+    """ dict representation of a ListNode or ChoiceNode item """
+    if isinstance(item, XMLObject):
+        return item.toDict()
+    return item
+
+def walkedItems(node, xmlObject):
+    """ XMLObjects walked under `node`, as (path step, item) pairs
+
+        None is returned for the Nodes with no items to walk.
+    """
+    nodeType = node.getType()
+    if nodeType == 'ListNode' or \
+           (nodeType == 'ChoiceNode' and node.isNoLimit()):
+        return [ (index, item)
+                 for index, item in enumerate(getattr(xmlObject, node.getName()))
+                 if isinstance(item, XMLObject) ]
+    elif nodeType == 'ItemNode':
+        item = getattr(xmlObject, node.getName())
+        if isinstance(item, XMLObject):
+            return [ (None, item) ]
+        return []
+    return None
+
+def iterWalkedNodes(xmlObject, depth, path):
+    for nodeName, node in xmlObject.getNodes().iteritems():
+        if nodeName == XML_PI:
+            # we silently ignore the head XML processing-instruction
+            continue
+        yield node, xmlObject, depth, path + (nodeName,)
+
+def iterWalkedItems(items, depth, path):
+    for index, item in items:
+        if index is not None:
+            itemPath = path + (index,)
+        else:
+            itemPath = path
+        for entry in iterWalkedNodes(item, depth, itemPath):
+            yield entry
+
+# used by `sameNodeXml`
+_prettyPrinter = PrettyXMLPrinter()
+
+def sameNodeXml(node, value1, xmlObject1, value2, xmlObject2):
+    """ Compare the XML representations of `node` in two XMLObjects """
+    xml = []
+    for value, xmlObject in ((value1, xmlObject1), (value2, xmlObject2)):
+        data = u''.join(node.iterXmlRepr(value, xmlObject))
+        if xmlObject._stripStrings:
+            data = u''.join(_prettyPrinter.iterPrettyPrint(data, fragment=True))
+        xml.append(data)
+    return xml[0] == xml[1]
+
+def restoreXMLObject(cls, values, children=()):
+    """ Build an XMLObject pickled by `XMLObject.__reduce_ex__`.
+
+        `values` are the Node values, in ``cls.__stateNodes__`` order,
+        and `children` the indexes of the lists and XMLObjects among
+        them. Values are stored without type checking, lists being
+        turned back into the list type of their Node. The parent links
+        of the XMLObjects built anew (unpickled or deep copied) are
+        restored, the ones shared with the original by `copy.copy`
+        keep theirs.
+    """
+    xmlObject = cls._newEmpty()
+    keys = cls.__stateKeys__
+    if cls._compact:
+        store = xmlObject.__setattr__
+        for key, value in zip(keys, values):
+            store(key, value)
+    else:
+        store = xmlObject._attributes.__setitem__
+        xmlObject._attributes.update(zip(keys, values))
+    for index in children:
+        value = values[index]
+        if type(value) is list:
+            node = cls.__stateNodes__[index]
+            items = value
+            value = node.getInitialValue()
+            value.data = items
+            value._owner = xmlObject
+            for item in items:
+                if not isinstance(item, XMLObject):
+                    continue
+                if item._parentNode is NO_PARENT:
+                    item._parentNode = node
+                    item._holder = xmlObject
+                else:
+                    shareHolder(item, xmlObject)
+            store(keys[index], value)
+        elif value._parentNode is NO_PARENT:
+            value._parentNode = xmlObject
+        else:
+            shareHolder(value, xmlObject)
+    xmlObject._init()
+    return xmlObject
+
+def parseDocument(task):
+    """ Parse one document of `XMLObject.fromXmlMany`.
+
+        `task` is a ``(cls, index, xmlData, parser)`` tuple. Returns the
+        ``index`` with either the XMLObject or the error raised while
+        parsing ``xmlData``. Errors which can't be pickled back from the
+        worker processes are wrapped in a `ParseError`.
+    """
+    cls, index, xmlData, parser = task
+    try:
+        return index, cls.fromXml(xmlData, parser=parser)
+    except Exception as ex:
+        try:
+            pickle.loads(pickle.dumps(ex, pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            ex = ParseError(repr(ex), xmlData)
+        return index, ex
+
 class ParseError(Exception):
     """ XML Parse Error.
 
@@ -37,7 +313,8 @@ class ParseError(Exception):
     """
 
     def __init__(self, domException, xmlData, encoding=None):
-        Exception.__init__(self)
+        # arguments kept in `args` so that the exception can be pickled
+        Exception.__init__(self, domException, xmlData, encoding)
         self._domExcp = domException
         self._xmlData = xmlData
         self._encoding = encoding
@@ -75,13 +352,61 @@ class MetaAttribute(object):
         newVal = self._node.checkType(val)
         if newVal is not False:
             if isinstance(newVal, XMLObject):
+                addHolder(newVal, inst)
                 newVal.setParentNode(inst)
+            elif isinstance(newVal, UserList):
+                # before storing it, so that the old value gets copied
+                # if needed
+                newVal.setOwner(inst)
             inst.set(self._attrName,newVal)
+            touch(inst)
+        else:
+            raise TypeError(u'Incorrect type in assignment of '+ \
+                            utils.customUnicode(str(self._node.getName()),self._encoding)
+                            + u' (%s)' % utils.customUnicode(str(repr(val)),self._encoding))
+
+class SlotMetaAttribute(MetaAttribute):
+    """ MetaAttribute of the compact XMLObjects (see ``_compact``),
+        storing the Node value in the ``slot`` instance slot.
+    """
+
+    def __init__(self, nodeInstance, encoding, slot):
+        MetaAttribute.__init__(self, nodeInstance, encoding)
+        self._slot = slot
+
+    def __get__(self, inst, cls):
+        nodeValue = getattr(inst, self._slot, None)
+        if not cls._unicodeOutput and type(nodeValue) == type(u''):
+            nodeValue = nodeValue.encode(cls._encoding)
+        return nodeValue
+
+    def __set__(self, inst, val):
+        newVal = self._node.checkType(val)
+        if newVal is not False:
+            if isinstance(newVal, XMLObject):
+                addHolder(newVal, inst)
+                newVal.setParentNode(inst)
+            elif isinstance(newVal, UserList):
+                newVal.setOwner(inst)
+            setattr(inst, self._slot, newVal)
+            touch(inst)
         else:
             raise TypeError(u'Incorrect type in assignment of '+ \
                             utils.customUnicode(str(self._node.getName()),self._encoding)
                             + u' (%s)' % utils.customUnicode(str(repr(val)),self._encoding))
 
+def slotName(nodeName):
+    """ Name of the slot storing the `nodeName` Node value of compact
+        XMLObjects.
+    """
+    return re.sub(r'\W', '_', '_XO_%s' % nodeName)
+
+def _compactGet(self, nodeName):
+    return getattr(self, self.__slotNames__.get(nodeName, nodeName), None)
+
+def _compactSet(self, nodeName, val):
+    setattr(self, self.__slotNames__.get(nodeName, nodeName), val)
+
 class MetaXMLObject(type):
     """ The place where all magic happens:
 
@@ -101,7 +426,10 @@ class MetaXMLObject(type):
     __methods__ = [ 'set','get', 'getEntities', 'orderNodes', 'setParentNode',
                     'getClassName', 'toDict', 'fromDict', 'getNodes',
                     'getNodeWithName', 'setName', 'orderAttrs', 'getParentNode',
-                    'toXml', 'fromXml', '_fromDom','getName', 'getChildren']
+                    'toXml', 'fromXml', '_fromDom','getName', 'getChildren',
+                    'writeXml', 'iterXml', '_iterXml', 'iterFromXml',
+                    '_newEmpty', '_iterPrettyXml', 'fingerprint', 'walk',
+                    '_walk', 'getXmlCacheStats', 'fromXmlMany']
 
     def __new__(cls, className, bases, dictionnary):
 
@@ -114,6 +442,13 @@ class MetaXMLObject(type):
         dictionnary['__name__'] = className
         dictionnary['__nodes__'] = {}
         dictionnary['__ns_nodes__'] = {}
+        # built on first use by XMLObject._iterXml
+        dictionnary['__serializer__'] = None
+        dictionnary['__prettySerializer__'] = None
+        # built on first use by ExpatParser.getDispatchTable
+        dictionnary['__expatTable__'] = None
+        # see `XMLObject.getXmlCacheStats`
+        dictionnary['__xmlCacheStats__'] = {'hits': 0, 'misses': 0}
 
         nodes = filter(lambda x: x is not None,
                        map(lambda y,z: cls.isXONode(y,z),
@@ -124,6 +459,14 @@ class MetaXMLObject(type):
         except KeyError:
             encoding = XMLObject._encoding
 
+        compact = dictionnary.get('_compact',
+                                  getattr(bases[0], '_compact', False))
+        if not compact and \
+               [ base for base in bases if getattr(base, '_compact', False) ]:
+            # the inherited Nodes are stored in slots
+            raise TypeError("%s: subclasses of compact XMLObjects are "
+                            "compact too" % className)
+
         foundAMain = False
         # build the MetaAttributes corresponding to the nodes of the class
         for name, instance in nodes:
@@ -138,7 +481,11 @@ class MetaXMLObject(type):
                 instance.setName(name)
             instance.setParentType(className)
             dictionnary['__nodes__'][name] = instance
-            dictionnary[name] = MetaAttribute(instance,encoding)
+            dictionnary[name] = cls.createMetaAttribute(instance, encoding,
+                                                        compact)
+
+        if compact:
+            cls.addSlots(dictionnary, bases)
 
         newClass = type.__new__(cls, className, bases, dictionnary)
 
@@ -154,7 +501,8 @@ class MetaXMLObject(type):
                 nodeCopy = copy.copy(node)
                 nodeCopy.setParentType(className)
                 newClass.__nodes__[nodeName] = nodeCopy
-                setattr(newClass, nodeName, MetaAttribute(nodeCopy,encoding))
+                setattr(newClass, nodeName,
+                        cls.createMetaAttribute(nodeCopy, encoding, compact))
 
 
         # add the xmlProcessingInstruction
@@ -168,6 +516,54 @@ class MetaXMLObject(type):
         xmlPI.setParentType(newClass.getClassName())
         newClass.__nodes__[XML_PI] = xmlPI
 
+        # Nodes compared by `XMLObject.__eq__`: when not empty, the main
+        # Node is rendered alone, along with the attributes
+        nodes = newClass.__nodes__
+        mainNodes = [ nodeName for nodeName in newClass._nodesOrder or nodes.keys()
+                      if nodeName in nodes and nodes[nodeName].isMain() and
+                      not isinstance(nodes[nodeName], Attribute) ]
+        newClass.__mainNode__ = mainNodes and mainNodes[-1] or None
+        newClass.__comparedNodes__ = tuple(sorted([
+            nodeName for nodeName, node in nodes.iteritems()
+            if not isinstance(node, ProcessingInstructionNode) and
+            nodeName != newClass.__mainNode__ ]))
+        newClass.__headNodes__ = tuple(sorted([
+            nodeName for nodeName, node in nodes.iteritems()
+            if isinstance(node, Attribute) ]))
+
+        # Nodes pickled by `XMLObject.__reduce_ex__` and the keys (slot
+        # names of compact classes) their values are stored under
+        newClass.__stateNodes__ = tuple([
+            nodes[nodeName] for nodeName in sorted(nodes)
+            if not isinstance(nodes[nodeName], ProcessingInstructionNode) ])
+        newClass.__stateKeys__ = tuple([
+            '_XO_%s' % node.getName() for node in newClass.__stateNodes__ ])
+        if newClass._compact:
+            newClass.__stateKeys__ = tuple([
+                newClass.__slotNames__.get(key, key)
+                for key in newClass.__stateKeys__ ])
+
+        # MetaAttributes looked up by `XMLObject.__getattr__`
+        newClass.__metaAttributes__ = dict([
+            (node.getName(), newClass.__dict__[nodeName])
+            for nodeName, node in nodes.iteritems()
+            if isinstance(newClass.__dict__.get(nodeName), MetaAttribute) ])
+        newClass.__childAttributes__ = tuple([
+            attr for attr in newClass.__metaAttributes__.itervalues()
+            if attr._node.getType() in ('ItemNode', 'ListNode', 'ChoiceNode') ])
+        if newClass.__mainNode__:
+            newClass.__mainGetter__ = staticmethod(
+                newClass.__dict__[newClass.__mainNode__].__get__)
+        else:
+            newClass.__mainGetter__ = None
+
+        # entities escaping function of the class instances, built from
+        # the `getEntities` of a bare instance
+        newClass.__entities__ = list(
+            newClass.__new__(newClass).getEntities())
+        newClass.__escaper__ = staticmethod(
+            utils.makeEscaper(newClass.__entities__))
+
         # finally register the new class type so that it can be found
         # using its name
         classregistry.registry(newClass._registry).addClass(newClass)
@@ -178,6 +574,43 @@ class MetaXMLObject(type):
 
         return newClass
 
+    def addSlots(cls, dictionnary, bases):
+        """ Make the class being created a compact one: Node values
+            are stored in ``__slots__`` instead of an ``_attributes``
+            dictionnary.
+        """
+        nodes = dictionnary['__nodes__'].values()
+        for base in bases:
+            nodes.extend(getattr(base, '__nodes__', {}).values())
+        slotNames = {}
+        for node in nodes:
+            slotNames['_XO_%s' % node.getName()] = slotName(node.getName())
+        slots = []
+        for slot in ['_parentNode', '_holder', '_sharedHolders', '_dirty',
+                     '_fingerprint', '_xmlCache', XML_PI] + slotNames.values():
+            inherited = [ klass for base in bases for klass in base.__mro__
+                          if slot in getattr(klass, '__slots__', ()) ]
+            if slot not in slots and not inherited:
+                slots.append(slot)
+        if not [ base for base in bases if base.__weakrefoffset__ ]:
+            # for the weak dictionnaries of `shareHolder`
+            slots.append('__weakref__')
+        for base in bases:
+            slotNames.update(getattr(base, '__slotNames__', {}))
+        dictionnary['__slots__'] = tuple(slots)
+        dictionnary['__slotNames__'] = slotNames
+        dictionnary['get'] = _compactGet
+        dictionnary['set'] = _compactSet
+
+    addSlots = classmethod( addSlots )
+
+    def createMetaAttribute(cls, node, encoding, compact):
+        if compact:
+            return SlotMetaAttribute(node, encoding, slotName(node.getName()))
+        return MetaAttribute(node, encoding)
+
+    createMetaAttribute = classmethod( createMetaAttribute )
+
     def isXONode(cls, name, instance):
         """ Checks if an instance variable is an XMLObject Node
 
@@ -201,24 +634,31 @@ class MetaXMLObject(type):
         if not registryID:
             registryID = XMLObject._registry
         registry = classregistry.registry(registryID)
-        for klass in registry.allClasses():
-            try:
-                data = xmlData.encode(klass._encoding)
-            except:
-                data = xmlData
-
+        data = xmlData
+        if type(xmlData) == type(u''):
+            # the class encoding is needed before parsing
+            from . ExpatParser import getRootElementName
             try:
-                dom = parseString(data)
+                klass = registry.getClassForElement(getRootElementName(xmlData))
+            except KeyError:
+                raise ParseError(u'No XMLObject found for',xmlData)
             except Exception as ex:
-                raise ParseError(ex, data)
-            else:
-                root_node_name = dom.documentElement.localName
-                if klass.getName() == root_node_name:
-                    val = klass()
-                    val._fromDom(dom.documentElement)
-                    dom.unlink()
-                    return val
-        raise ParseError(u'No XMLObject found for',xmlData)
+                raise ParseError(ex, xmlData)
+            data = xmlData.encode(klass._encoding)
+
+        try:
+            dom = parseString(data)
+        except Exception as ex:
+            raise ParseError(ex, data)
+        try:
+            klass = registry.getClassForElement(dom.documentElement.localName)
+        except KeyError:
+            dom.unlink()
+            raise ParseError(u'No XMLObject found for',xmlData)
+        val = klass._newEmpty()
+        val._fromDom(dom.documentElement)
+        dom.unlink()
+        return val
 
     instanceFromXml = classmethod( instanceFromXml )
 
@@ -230,6 +670,7 @@ class XMLObject(object):
 
         - ``_name`` : overrides `__name__`
         - ``_entities`` : user-defined entities stored in a tuples-list,
+          fixed at class creation (see `getEntities`),
         - ``_stripStrings`` : does xml import should strip strings ? (remove tabs,
           extra spaces)
         - ``_prettyPrint`` : should XML output be pretty printed ?
@@ -239,6 +680,13 @@ class XMLObject(object):
           * ``_attrsOrder`` : a list of Attributes (StringAttribute, IntegerAttribute, ...) names
 
         - ``_encoding`` : document encoding (default: 'utf-8')
+        - ``_parser`` : `fromXml` backend, 'dom' (default) or 'expat'
+        - ``_compact`` : store Node values in ``__slots__`` to save memory.
+          Compact instances can't get attributes other than their Nodes.
+        - ``_cacheXml`` : keep the XML data of the instances, rendered
+          again only when one XMLObject of their tree gets modified.
+        - ``_cacheFingerprint`` : keep the `fingerprint` of the instances
+          the same way.
 
         If you pass the keyword ``main=True`` to one of your Nodes, it will be hooked so that
         calling Node methods ('append' for instance) from the XMLObject instance will
@@ -271,12 +719,17 @@ class XMLObject(object):
 
     __metaclass__ = MetaXMLObject
 
+    # instances of subclasses get a __dict__, unless they're compact
+    __slots__ = ()
+
     _registry = 'registryID'
     _encoding = 'utf-8'
     _unicodeOutput = True
 
     _stripStrings = True
     _prettyPrint = True
+    _parser = 'dom'
+    _compact = False
 
     _defaultEntities = [ ('&', '&amp;'),
                          ('<', '&lt;'),
@@ -291,16 +744,34 @@ class XMLObject(object):
 
     _dtd = None
 
+    _cacheFingerprint = False
+    # cached by `fingerprint`
+    _fingerprint = None
+
+    _cacheXml = False
+    # XMLObject holding the instance in a {Typed,Mixed}List
+    _holder = None
+    # other XMLObjects holding the instance, see `shareHolder`
+    _sharedHolders = None
+    # modified since its data got cached (see `touch`)
+    _dirty = True
+    # {serializer arguments: XML data} cache of `_cachedXml`
+    _xmlCache = None
+
+
     def __init__(self, *args, **kw):
-        self._attributes = {}
+        if not self._compact:
+            self._attributes = {}
 
-        self._prettyPrinter = PrettyXMLPrinter()
+        # i have a dummy parent, overriden when i'm encapsulated in a
+        # ChoiceNode or ListNode
+        self.setParentNode(NO_PARENT)
 
         # set default values for the new class instance
         for attrName, instance in self.getNodes().iteritems():
-            instance.resetValue()
-            if instance.getValue() is not None:
-                setattr(self, attrName, instance.getValue())
+            value = instance.getInitialValue()
+            if value is not None:
+                setattr(self, attrName, value)
 
         # if we have only one Node, it can directly be initialized
         # by unnamed constructor argument (in `args` tuple)
@@ -315,10 +786,6 @@ class XMLObject(object):
             if self.getNodeWithName(k) is not None:
                 setattr(self, k, v)
 
-        # i have a dummy parent, overriden when i'm encapsulated in a
-        # ChoiceNode or ListNode
-        self.setParentNode(Node())
-
         # execute user-defined initialization code
         self._init()
 
@@ -326,21 +793,115 @@ class XMLObject(object):
     ### Private
     #####################################################################
 
+    def _newEmpty(cls):
+        """ Lightweight instance creation, used by the parsers.
+
+            Unlike `__init__`, no Node value is set, not even the
+            default ones: the caller is expected to set all of them,
+            then to run the user-defined `_init` hook.
+        """
+        self = cls.__new__(cls)
+        if not cls._compact:
+            self._attributes = {}
+        self._parentNode = NO_PARENT
+        return self
+
+    _newEmpty = classmethod(_newEmpty)
+
+    def _getCachedFingerprint(self):
+        """ The fingerprint computed since the last modification of
+            the instance tree, if any (see `_cacheFingerprint`).
+        """
+        if not self._cacheFingerprint or isDirty(self):
+            return None
+        try:
+            return self._fingerprint
+        except AttributeError:
+            # unset compact XMLObject slot
+            return None
+
     def _fromDom(self, dom):
         """ Building an XMLObject given its pendant DOM tree.
 
+            The element children of `dom` are grouped by name once,
+            and handed to each Node with the ``children`` keyword.
         """
+        children = utils.groupChildrenByName(dom)
         for attrName, node in self.getNodes().iteritems():
             try:
                 value = node.getValueFromDom(dom, attrName,
                                              registry=self._registry,
-                                             stripStrings=self._stripStrings)
+                                             stripStrings=self._stripStrings,
+                                             children=children)
             except Exception as e:
                 raise
             else:
                 setattr(self, attrName, value)
+        self._init()
         return self
 
+    def _iterXml(self, headers=1):
+        """ Walking an XMLObject tree to build its XML representation.
+
+            Yield unicode strings which, joined, give the compact
+            (not pretty printed) XML data of the instance. The work is
+            done by a serializer function generated for the XMLObject
+            class the first time one of its instances is rendered (see
+            `XMLSerializer`).
+        """
+        serializer = self.__serializer__
+        if serializer is None:
+            from . XMLSerializer import compileSerializer
+            serializer = compileSerializer(self.__class__)
+            self.__class__.__serializer__ = staticmethod(serializer)
+        if self._cacheXml:
+            return self._cachedXml(serializer, headers)
+        return serializer(self, headers)
+
+    def _iterPrettyXml(self, headers=1, depth=0, indent=u' '):
+        """ Walking an XMLObject tree to build its pretty printed XML
+            representation.
+
+            Yield '\\n' terminated lines, the instance tag being indented
+            `depth` times by `indent`. Just like `_iterXml`, the work is
+            done by a serializer function generated for the XMLObject
+            class.
+        """
+        serializer = self.__prettySerializer__
+        if serializer is None:
+            from . XMLSerializer import compilePrettySerializer
+            serializer = compilePrettySerializer(self.__class__)
+            self.__class__.__prettySerializer__ = staticmethod(serializer)
+        if self._cacheXml:
+            return self._cachedXml(serializer, headers, depth, indent)
+        return serializer(self, headers, depth, indent)
+
+    def _cachedXml(self, serializer, *args):
+        """ XML data of the instance, rendered by `serializer` unless
+            no XMLObject of its tree was modified since the last time.
+
+            Returned as a one chunk tuple, see `_cacheXml`.
+        """
+        stats = self.__xmlCacheStats__
+        key = (serializer,) + args
+        cache = None
+        if not isDirty(self):
+            try:
+                cache = self._xmlCache
+            except AttributeError:
+                # unset compact XMLObject slot
+                pass
+            if cache is not None and key in cache:
+                stats['hits'] += 1
+                return (cache[key],)
+        stats['misses'] += 1
+        data = u''.join(serializer(self, *args))
+        if cache is None:
+            cache = self._xmlCache = {}
+        cache[key] = data
+        markClean(self)
+        return (data,)
+
     #####################################################################
     ### Nodes Access (Reserved to MetaAttribute class)
     #####################################################################
@@ -371,18 +932,41 @@ class XMLObject(object):
         pass
 
     def __ne__(self, other):
-        if not isinstance(other,XMLObject):
-            raise TypeError("Comparing an XMLObject with non-XMLObject is forbiden")
-        o1 = self.toXml(headers=0)
-        o2 = other.toXml(headers=0)
-        return o1 != o2
+        return not self.__eq__(other)
 
     def __eq__(self, other):
+        """ Two XMLObjects are equal if they have the same name and the
+            same Node values, compared Node by Node.
+        """
         if not isinstance(other,XMLObject):
             raise TypeError("Comparing an XMLObject with non-XMLObject is forbiden")
-        o1 = self.toXml(headers=0)
-        o2 = other.toXml(headers=0)
-        return o1 == o2
+        if self is other:
+            return True
+        if self.getName() != other.getName():
+            return False
+        names = self.__comparedNodes__
+        main = self.__mainNode__
+        if names != other.__comparedNodes__ or main != other.__mainNode__:
+            return False
+        fingerprint1 = self._getCachedFingerprint()
+        fingerprint2 = other._getCachedFingerprint()
+        if None not in (fingerprint1, fingerprint2) and fingerprint1 != fingerprint2:
+            return False
+        if main is not None:
+            value1, value2 = getattr(self, main), getattr(other, main)
+            empty = isEmptyValue(value1)
+            if empty != isEmptyValue(value2):
+                return False
+            if not empty:
+                if not sameNodeValues(self.__nodes__[main], value1, self, value2, other):
+                    return False
+                names = self.__headNodes__
+        for attrName in names:
+            if not sameNodeValues(self.__nodes__[attrName],
+                                  getattr(self, attrName), self,
+                                  getattr(other, attrName), other):
+                return False
+        return True
 
     def __cmp__(self, other):
         """ Two XMLObjects are equal if they have the same XML representation
@@ -394,20 +978,54 @@ class XMLObject(object):
         ## @PN: solved now ?
         if not isinstance(other,XMLObject):
             raise TypeError("Comparing an XMLObject with non-XMLObject is forbiden")
+        if self == other:
+            return 0
 
-        o1 = self.toXml(headers=0, prettyPrint=False)
-        o2 = other.toXml(headers=0, prettyPrint=False)
+        o1 = u''.join(self._iterXml(headers=0))
+        o2 = u''.join(other._iterXml(headers=0))
         return cmp(o1, o2)
 
+    def __hash__(self):
+        return self.fingerprint()
+
+    def fingerprint(self):
+        """ Hash value of the XMLObject content. Equal XMLObjects have
+            the same fingerprint, so XMLObjects can be stored in sets
+            or used as dict keys.
+
+            The instances of the XMLObjects with ``_cacheFingerprint``
+            keep their fingerprint until they or one of the XMLObjects
+            they hold get modified (see `touch`). Don't modify an
+            XMLObject stored in a set or used as a dict key.
+        """
+        fingerprint = self._getCachedFingerprint()
+        if fingerprint is None:
+            values = [ self.getName() ]
+            names = self.__comparedNodes__
+            main = self.__mainNode__
+            if main is not None:
+                value = getattr(self, main)
+                if not isEmptyValue(value):
+                    node = self.__nodes__[main]
+                    values.append(node.getValueFingerprint(value, self))
+                    names = self.__headNodes__
+            for attrName in names:
+                node = self.__nodes__[attrName]
+                values.append(node.getValueFingerprint(getattr(self, attrName), self))
+            fingerprint = hash(tuple(values))
+            if self._cacheFingerprint:
+                self._fingerprint = fingerprint
+                markClean(self)
+        return fingerprint
+
     def __getattr__(self, attrName):
         if '_' not in attrName[:1]:
-            for node in self.getNodes().values():
-                if node.isMain():
-                    attr = MetaAttribute(node, self._encoding)
-                    return getattr(attr.__get__(self, self.__class__), attrName)
-                elif node.getName() == attrName:
-                    attr = MetaAttribute(node, self._encoding)
-                    return attr.__get__(self, self.__class__)
+            attr = self.__metaAttributes__.get(attrName)
+            if attr is not None:
+                return attr.__get__(self, self.__class__)
+            # delegate to the main Node value
+            if self.__mainGetter__ is not None:
+                return getattr(self.__mainGetter__(self, self.__class__), attrName)
         raise AttributeError(attrName)
 
     __getitem__ = __getattr__
@@ -432,7 +1050,7 @@ class XMLObject(object):
     def getParentNode(self):
         """ Accessing the parent Node instance.
 
-            Return a dummy Node() by default (see `__init__`).
+            Return the shared `NO_PARENT` dummy Node by default.
         """
         return self._parentNode
 
@@ -451,35 +1069,72 @@ class XMLObject(object):
             ``node`` is the Node instance to apply user-defined
             action. ``xmlObject`` is the XMLObject instance handling
             this ``node``. ``args`` and ``kw`` store the content of their
-            homonyms in the ``forEach`` method prototype.
+            homonyms in the ``forEach`` method prototype, ``kw`` being
+            extended with the ``depth`` of the ``node``.
 
-            Warning: This method can be very CPU-expensive if the
-            XMLObject is deep (nested ListNodes and/or ChoiceNodes)
-            because it make use of a recursion mechanism.
+            ListNodes, ItemNodes and unbounded ChoiceNodes are not
+            passed to `callableFunc`, their items are walked instead. See
+            `walk` for a lazy version of this method.
         """
-        if not 'depth' in kw:
-            kw['depth'] = 0
-        depth = kw['depth']
-        for nodeName,node in self.getNodes().iteritems():
-            if nodeName == XML_PI:
-                # we silently ignore the head XML processing-instruction
-                continue
-            if node.getType() == 'ListNode':
-                kw.update({'depth': depth + 1})
-                for item in getattr(self, node.getName()):
-                    item.forEach(callableFunc, *args, **kw)
-                kw['depth'] -= 1
-            elif node.getType() == 'ChoiceNode' and node.isNoLimit():
-                kw.update({'depth': depth + 1})
-                for item in getattr(self, node.getName()):
-                    item.forEach(callableFunc, *args, **kw)
-                kw['depth'] -= 1
-            elif node.getType() == 'ItemNode':
-                kw.update({'depth': depth + 1})
-                getattr(self, nodeName).forEach(callableFunc, *args, **kw)
-                kw['depth'] -= 1
+        startDepth = kw.pop('depth', 0)
+        for (node, xmlObject, depth, path), items in self._walk():
+            if items is None:
+                kw['depth'] = startDepth + depth
+                callableFunc(node, xmlObject=xmlObject, *args, **kw)
+
+    def walk(self, postOrder=False, prune=None):
+        """ Iterate over the Nodes of the XMLObject tree.
+
+            Yield a ``(node, xmlObject, depth, path)`` tuple for each
+            Node, ``xmlObject`` being the XMLObject instance handling
+            the ``node``. ``path`` is the tuple of Node names and list
+            indexes leading from this XMLObject to the ``node``, like
+            ``('items', 2, 'position')``. The items of ListNodes,
+            ItemNodes and unbounded ChoiceNodes are walked one level
+            deeper, right after their Node or, if `postOrder` is True,
+            right before it.
+
+            `prune` is an optional callable receiving the same tuple
+            items. Nodes for which it returns True are skipped along
+            with their items.
+
+            The tree is walked with an explicit stack, so deep
+            XMLObjects don't hit the recursion limit.
+        """
+        for entry, items in self._walk(postOrder, prune):
+            yield entry
+
+    def _walk(self, postOrder=False, prune=None):
+        """ `walk` generator, yielding each entry along with its
+            `walkedItems`.
+        """
+        stack = [ (iterWalkedNodes(self, 0, ()), None, None) ]
+        while stack:
+            for entry in stack[-1][0]:
+                if prune is not None and prune(*entry):
+                    continue
+                node, xmlObject, depth, path = entry
+                items = walkedItems(node, xmlObject)
+                if not postOrder:
+                    yield entry, items
+                if items:
+                    stack.append((iterWalkedItems(items, depth + 1, path),
+                                  entry, items))
+                    break
+                if postOrder:
+                    yield entry, items
             else:
-                callableFunc(node, xmlObject=self, *args, **kw)
+                iterator, entry, items = stack.pop()
+                if postOrder and entry is not None:
+                    yield entry, items
+
+    def getXmlCacheStats(cls):
+        """ Hits and misses of the XML data cached by the class
+            instances, see `_cacheXml`.
+        """
+        return dict(cls.__xmlCacheStats__)
+
+    getXmlCacheStats = classmethod(getXmlCacheStats)
 
     def getEntities(self):
         """ Get all entities specified in the xmlobject:
@@ -487,7 +1142,11 @@ class XMLObject(object):
         - `_defaultEntities` stores the most common entities (<, >, ...)
         - `_entities` stores user-defined entities
 
-        This method merges the two entities lists.
+        This method merges the two entities lists. Escaping strings
+        with them is done by the `__escaper__` function of the class,
+        built from this method when the class is created, called on
+        an instance holding no Node value: later changes of the
+        entities aren't taken into account.
         """
         return self._entities + self._defaultEntities
 
@@ -571,84 +1230,84 @@ class XMLObject(object):
 
             Return a string representing the XMLObject instance
         """
-        result = u''
-        if headers:
-            # I need to make this more smart
-            for nodeName, node in self.getNodes().iteritems():
-                if isinstance(node, ProcessingInstructionNode ):
-                    result += node.xmlrepr()
-
-        attrs, others = u'', u''
-        name = self.getName()
-        result += u'<%s' % name
-
-        mainNode = None
-        mainNodeName = ''
-
-        # XMLObject sub-tags
-        nodeNames, nodes = self.orderNodes(self._nodesOrder)
-        for index in range(len(nodes)):
-            attrName, node = nodeNames[index], nodes[index]
-            if isinstance(node, Attribute) or isinstance(node,ProcessingInstructionNode):
-                continue
-            # 0. backup default node value
-            default = node.getValue()
-            # 1. set node value temporary
-            node.setValue(getattr(self, attrName))
-            nodeRepr = node.xmlrepr(parentInstance=self)
-            try:
-                others += nodeRepr
-            except:
-                raise
-            if node.isMain():
-                mainNode = nodeRepr
-                mainNodeName = attrName
-            # 2. reset value to default
-            node.setValue(default)
-
-        # XMLObject tag attributes
-        attrNames, nodes = self.orderAttrs()
-        for index in range(len(nodes)):
-            attrName, node = attrNames[index], nodes[index]
-            if not isinstance(node, Attribute):
-                continue
-            # 0. backup default node value
-            default = node.getValue()
-            # 1. set node value temporary
-            node.setValue(getattr(self, attrName))
-            nodeRepr = node.xmlrepr(parentInstance=self)
-            if nodeRepr:
-                attrs += u' ' + nodeRepr
-            # 2. reset value to default
-            node.setValue(default)
-
-        if attrs:
-            result += attrs
-        if others != u'':
-            if mainNode:
-                try:
-                    others = re.match('<%(main)s>(.*)</%(main)s>' % {'main':mainNodeName},
-                                      mainNode).groups()[0]
-                except:
-                    others = mainNode
-            result = u"%s>%s</%s>" % (result, others, name)
-        else:
-            result = u'%s/>' % result
-
         if self._stripStrings and self._prettyPrint and prettyPrint:
-            result = self._prettyPrinter.prettyPrint(result, indent=' '*tabLength)
+            result = u''.join(self._iterPrettyXml(headers, 0, u' '*tabLength))[:-1]
+        else:
+            result = u''.join(self._iterXml(headers=headers))
 
         result = result.encode(self._encoding)
         return result
 
-    def fromXml(cls, xmlData):
+    def iterXml(self, chunkSize=8192, headers=1, tabLength=2, prettyPrint=True):
+        """ Exporting an XMLObject instance to XML, chunk by chunk.
+
+            Same keyword parameters as `toXml`. This generator walks the
+            XMLObject tree and yields XML data encoded using `_encoding`,
+            by chunks of about `chunkSize` characters. It can directly be
+            returned as a WSGI application response body.
+        """
+        pretty = self._stripStrings and self._prettyPrint and prettyPrint
+        if pretty:
+            chunks = self._iterPrettyXml(headers, 0, u' '*tabLength)
+        else:
+            chunks = self._iterXml(headers=headers)
+
+        buf, size = [], 0
+        for chunk in chunks:
+            if size >= chunkSize:
+                yield u''.join(buf).encode(self._encoding)
+                buf, size = [], 0
+            buf.append(chunk)
+            size += len(chunk)
+        result = u''.join(buf)
+        if pretty:
+            # no line break after the last line
+            result = result[:-1]
+        if result:
+            yield result.encode(self._encoding)
+
+    def writeXml(self, out, headers=1, tabLength=2, prettyPrint=True,
+                 chunkSize=8192):
+        """ Exporting an XMLObject instance to a file-like object.
+
+            Same keyword parameters as `toXml`. XML data produced by
+            `iterXml` is written to ``out`` (anything having a ``write``
+            method accepting byte strings) chunk by chunk, so memory
+            usage stays bounded when dealing with large XMLObjects.
+        """
+        for chunk in self.iterXml(chunkSize=chunkSize, headers=headers,
+                                  tabLength=tabLength, prettyPrint=prettyPrint):
+            out.write(chunk)
+
+    def fromXml(cls, xmlData, parser=None):
         """ Feeding an XMLObject instance with XML string data.
 
-            `xmlData` is parsed by `xml.dom.minidom.parseString`.
-            The resulting DOM tree is then used to build Nodes
-            recursively.
+            With the default 'dom' `parser`, `xmlData` is parsed by
+            `xml.dom.minidom.parseString`. The resulting DOM tree is
+            then used to build Nodes recursively.
+
+            The 'expat' `parser` builds the XMLObject instances while
+            parsing, without any DOM tree (see `ExpatParser`).
+            `xmlData` can then also be a file-like object.
+
+            When not given, `parser` is taken from the ``_parser``
+            class attribute.
         """
-        xo = cls()
+        parser = parser or cls._parser
+        if parser == 'expat':
+            from xml.parsers.expat import ExpatError
+            from . import ExpatParser
+            if type(xmlData) == type(u''):
+                xmlData = xmlData.encode(cls._encoding)
+            try:
+                return ExpatParser.parse(cls, xmlData)
+            except ExpatError as ex:
+                if hasattr(xmlData, 'read'):
+                    xmlData = ''
+                raise ParseError(ex, xmlData, encoding=cls._encoding)
+        elif parser != 'dom':
+            raise ValueError("Unknown XML parser: %r" % (parser,))
+        xo = cls._newEmpty()
         if type(xmlData) == type(u''):
             xmlData = xmlData.encode(xo._encoding)
         try:
@@ -662,6 +1321,117 @@ class XMLObject(object):
 
     fromXml = classmethod(fromXml)
 
+    def iterFromXml(cls, source, path, chunkSize=65536):
+        """ Stream the XMLObjects of a ListNode out of XML data.
+
+            `path` is a '/' separated list of Node names leading from
+            the XMLObject class to the ListNode, through ItemNodes and
+            ListNodes (for instance 'channel/items' for the `Rss` class
+            of the rss.py example). `source` is XML data or a file-like
+            object, parsed by chunks of `chunkSize` bytes with the
+            'expat' parser.
+
+            The ListNode items are yielded one at a time, no reference
+            to them is kept, so huge documents are processed using
+            constant memory.
+        """
+        from xml.parsers.expat import ExpatError
+        from . import ExpatParser
+        if type(source) == type(u''):
+            source = source.encode(cls._encoding)
+        # check the path now rather than on first iteration
+        ExpatParser.getPathSteps(cls, path)
+
+        def iterItems():
+            try:
+                for xmlObject in ExpatParser.iterParse(cls, source, path,
+                                                       chunkSize=chunkSize):
+                    yield xmlObject
+            except ExpatError as ex:
+                raise ParseError(ex, '', encoding=cls._encoding)
+        return iterItems()
+
+    iterFromXml = classmethod(iterFromXml)
+
+    def fromXmlMany(cls, documents, workers=None, chunkSize=1, ordered=True,
+                    parser=None):
+        """ Parse many independent XML documents in worker processes.
+
+            `documents` is an iterable of XML data, each item being
+            parsed by `fromXml` with the given `parser` in a pool of
+            `workers` processes (one per CPU by default).
+            ``(index, result)`` pairs are yielded, ``index`` being the
+            position of the document in `documents` and ``result``
+            either the XMLObject or the exception (`ParseError`,
+            `RequiredNodeError`, ...) raised while parsing it: a bad
+            document doesn't abort the batch.
+
+            Results come in the `documents` order unless `ordered` is
+            False, in which case they're yielded as soon as they're
+            ready. Documents are sent to the workers by batches of
+            `chunkSize`. The XMLObjects are pickled back, so their
+            classes must be importable from the worker processes. With
+            a single worker, the documents are parsed in the current
+            process.
+        """
+        tasks = ( (cls, index, xmlData, parser)
+                  for index, xmlData in enumerate(documents) )
+        if workers == 1:
+            return (parseDocument(task) for task in tasks)
+
+        def iterResults():
+            import multiprocessing
+            pool = multiprocessing.Pool(workers)
+            try:
+                if ordered:
+                    results = pool.imap(parseDocument, tasks, chunkSize)
+                else:
+                    results = pool.imap_unordered(parseDocument, tasks,
+                                                  chunkSize)
+                for result in results:
+                    yield result
+            finally:
+                pool.terminate()
+                pool.join()
+        return iterResults()
+
+    fromXmlMany = classmethod(fromXmlMany)
+
+    #####################################################################
+    ### Pickle support
+    #####################################################################
+
+    def __reduce_ex__(self, protocol):
+        """ Pickle (and copy) support.
+
+            Only a reference to the class, the Node values (lists as
+            plain lists) and the other instance attributes are pickled.
+            Parent links, processing instructions and cached data are
+            not: `restoreXMLObject` builds the instance back with
+            `_newEmpty`.
+        """
+        if self._compact:
+            values = [ getattr(self, key, None) for key in self.__stateKeys__ ]
+        else:
+            get = self._attributes.get
+            values = [ get(key) for key in self.__stateKeys__ ]
+        children = []
+        for index, value in enumerate(values):
+            if type(value) in LEAF_TYPES:
+                continue
+            elif isinstance(value, UserList):
+                values[index] = list(value.data)
+                children.append(index)
+            elif isinstance(value, XMLObject):
+                children.append(index)
+        state = None
+        if not self._compact:
+            state = dict([ (name, value)
+                           for name, value in self.__dict__.iteritems()
+                           if name not in RESTORED_ATTRIBUTES ]) or None
+        return restoreXMLObject, (self.__class__, tuple(values),
+                                  tuple(children)), state
+
     #####################################################################
     ### Python dictionnary input/output
     #####################################################################
@@ -673,25 +1443,22 @@ class XMLObject(object):
             XMLObject instance.
         """
         result = {}
-        parsedObjects = []
-
-        def getXOData(node, xmlObject, **kw):
-            if xmlObject == self:
-                result.update({ node.getName(): getattr(xmlObject, node.getName()) })
-            elif xmlObject not in parsedObjects:
-                parent = xmlObject.getParentNode()
-                subDict = xmlObject.toDict()
-                if parent.getName() == self.getName():
-                    result.update({xmlObject.getName(): subDict})
-                elif self.getNodeWithName(parent.getName()):
-                    # XXX: add more checking here (ChoiceNode.noLimit for instance)
-                    try:
-                        result[parent.getName()].append(subDict)
-                    except KeyError:
-                        result[parent.getName()] = [ subDict ]
-                parsedObjects.append(xmlObject)
-
-        self.forEach(getXOData)
+        for nodeName, node in self.getNodes().iteritems():
+            if nodeName == XML_PI:
+                continue
+            value = getattr(self, nodeName)
+            nodeType = node.getType()
+            if nodeType == 'ListNode' or \
+                   (nodeType == 'ChoiceNode' and node.isNoLimit()):
+                # every item is visited once, no bookkeeping needed
+                if value:
+                    result[nodeName] = [ itemToDict(item)
+                                         for item in value ]
+            elif nodeType == 'ItemNode':
+                if value is not None:
+                    result[value.getName()] = value.toDict()
+            else:
+                result[nodeName] = value
         return result
 
     def fromDict(cls, aDict):
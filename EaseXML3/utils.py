@@ -6,6 +6,8 @@
 #
 # Under PSF License (see COPYING)
 
+import re
+
 def lowWord(word):
     " FoObar -> foObar "
     return word[0].lower() + word[1:]
@@ -26,6 +28,35 @@ def replaceAll(initialString, translationHash):
             result = result.replace(key, value)
     return result
 
+def makeEscaper(translationHash):
+    """ Build a function behaving like `replaceAll` with the given
+        `translationHash`.
+
+        All the keys are looked for in a single scan of the string, so
+        strings having nothing to replace (the most common case) are
+        returned as is, after one pass.
+    """
+    translationHash = [ (key, value) for key, value in translationHash ]
+    keys = [ key for key, value in translationHash ]
+    if not keys or '' in keys:
+        return lambda initialString: replaceAll(initialString, translationHash)
+    search = re.compile('|'.join([ re.escape(key) for key in keys ])).search
+
+    def escape(initialString):
+        if initialString is None:
+            return ''
+        if search(initialString) is None:
+            return initialString
+        # The replacements stay ordered, one `replace` per key, rather
+        # than a single `re.sub`: the output of a replacement goes
+        # through the following ones (an ``_entities`` value holding
+        # '&' or '<' gets escaped again by the default entities, listed
+        # after it), which a single pass wouldn't do.
+        for key, value in translationHash:
+            initialString = initialString.replace(key, value)
+        return initialString
+    return escape
+
 def contains(list1, list2):
     """ Check if some elements of list1 appear in list2
 
@@ -33,16 +64,36 @@ def contains(list1, list2):
     """
     return [ it1 for it1 in list1 if it1 in list2 ]
 
-def getDirectChildrenWithName(parent, name):
+def getDirectChildrenWithName(parent, name, children=None):
     """ Fetch *direct* sub-nodes of a `parent` DOM tree. These
         nodes must have a name matching `name`.
 
+        `children` is the result of `groupChildrenByName` for `parent`,
+        when available.
+
         Return a list of DOM Nodes.
     """
+    if children is not None:
+        return children.get(name, [])
     return [ node for node in parent.childNodes
              if node.nodeType == node.ELEMENT_NODE and \
              node.localName == name ]
 
+def groupChildrenByName(parent):
+    """ Group the *direct* element sub-nodes of a `parent` DOM tree by
+        local name, in a single pass.
+
+        Return a dictionnary of DOM Nodes lists.
+    """
+    children = {}
+    for node in parent.childNodes:
+        if node.nodeType == node.ELEMENT_NODE:
+            try:
+                children[node.localName].append(node)
+            except KeyError:
+                children[node.localName] = [node]
+    return children
+
 def customUnicode(data, encoding):
     if not isinstance(data, (type(u''), type(None))):
         if encoding:
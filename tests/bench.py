@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2017 Doug Henderson <djndnbvg@gmail.com>
+# Copyright (C) 2004 Philippe Normand <phil@respyre.org>
+#
+# This file is part of EaseXML3 (http://easexml.base-art.net)
+#
+# Under PSF License (see COPYING)
+
+"""
+    EaseXML3's benchmarks
+
+    Run ``python bench.py [name ...]`` from this directory. Without
+    arguments, all the benchmarks are run.
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+sys.path.insert(0, '..')
+sys.path.insert(1, '.')
+
+from EaseXML3 import *
+
+class Point(XMLObject):
+    x = IntegerAttribute()
+    y = IntegerAttribute()
+    label = TextNode(optional=True)
+
+class CompactPoint(XMLObject):
+    _compact = True
+    x = IntegerAttribute()
+    y = IntegerAttribute()
+    label = TextNode(optional=True)
+
+class Shape(XMLObject):
+    name = StringAttribute()
+    points = ListNode('Point', optional=True)
+    groups = ListNode('Group', optional=True)
+
+class Group(XMLObject):
+    shapes = ListNode('Shape', optional=True)
+
+def instanceSize(xmlObject):
+    """ Bytes used by an XMLObject instance layout, Node values
+        excluded.
+    """
+    size = sys.getsizeof(xmlObject)
+    for name in ('__dict__', '_attributes'):
+        try:
+            size += sys.getsizeof(object.__getattribute__(xmlObject, name))
+        except AttributeError:
+            pass
+    return size
+
+def timeit(func, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def benchCompact(count=100000):
+    " memory and time used by regular and compact (__slots__) instances "
+    for klass in (Point, CompactPoint):
+        points = [ klass(x=i, y=i, label=u'p') for i in range(count) ]
+        build = timeit(lambda: [ klass(x=i, y=i, label=u'p')
+                                 for i in range(count) ])
+        read = timeit(lambda: [ p.x + p.y for p in points ])
+        print('%-14s %5d bytes/instance  build %.3fs  read %.3fs' %
+              (klass.__name__, instanceSize(points[0]), build, read))
+
+def wideShape(width):
+    shape = Shape(name=u'wide')
+    for i in range(width):
+        shape.points.append(Point(x=i, y=i))
+    return shape
+
+def deepShape(depth):
+    shape = Shape(name=u'deep')
+    for i in range(depth):
+        group = Group()
+        group.shapes.append(shape)
+        shape = Shape(name=u'deep')
+        shape.points.append(Point(x=i, y=i))
+        shape.groups.append(group)
+    return shape
+
+def benchToDict(sizes=(1000, 2000, 4000, 8000)):
+    " toDict on wide and deep (nested ListNodes) trees "
+    for size in sizes:
+        wide = wideShape(size)
+        deep = deepShape(size // 40)
+        print('%5d points: wide %.4fs  %4d levels: deep %.4fs' %
+              (size, timeit(wide.toDict), size // 40, timeit(deep.toDict)))
+
+def benchPickle(sizes=(1000, 4000)):
+    " pickle size and round trip time versus toXml/fromXml "
+    for size in sizes:
+        for shape, label in ((wideShape(size), '%5d points' % size),
+                             (deepShape(size // 100), '%5d levels' % (size // 100))):
+            data = pickle.dumps(shape, pickle.HIGHEST_PROTOCOL)
+            xml = shape.toXml(prettyPrint=False)
+            pickling = timeit(lambda: pickle.loads(
+                pickle.dumps(shape, pickle.HIGHEST_PROTOCOL)))
+            xmling = timeit(lambda: Shape.fromXml(shape.toXml(prettyPrint=False)))
+            print('%s: pickle %6d bytes %.4fs  xml %6d bytes %.4fs' %
+                  (label, len(data), pickling, len(xml), xmling))
+
+benchmarks = [ ('compact', benchCompact),
+               ('toDict', benchToDict),
+               ('pickle', benchPickle),
+               ]
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or [ name for name, func in benchmarks ]
+    for name, func in benchmarks:
+        if name in names:
+            print('== %s: %s' % (name, func.__doc__.strip()))
+            func()
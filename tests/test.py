@@ -14,12 +14,17 @@
 ## We want to be able to run this both from the test directory and the
 ## parent directory, beeing sure that we test the development version,
 ## and not any old installed version of EaseXML3.
+import copy
+import pickle
 import sys
+import threading
 import unittest
+from StringIO import StringIO
 
 sys.path.insert(0, '..')
 sys.path.insert(1, '.')
 from EaseXML3 import *
+from EaseXML3 import classregistry
 
 class Item(XMLObject):
     _entities = [ ('&xml;', 'eXtensible Markup Language')]
@@ -172,6 +177,28 @@ class TestEncoding(unittest.TestCase):
                           expected_encoding="utf-8",
                           expected_py_output=self.norwegian_unicode)
 
+    def testNestedLatin1(self):
+        """
+        Nested nodes are rendered as text and only the document is
+        encoded, once, with the class encoding.
+        """
+        class Latin1Holder(XMLObject):
+            _encoding = 'iso-8859-1'
+            _unicodeOutput = False
+            child = ItemNode('Latin1')
+
+        child = TestEncoding.Latin1(testNode=self.norwegian_latin1,
+                                    testAttr=self.norwegian_latin1)
+        holder = Latin1Holder(child=child)
+        node = holder.getNodeWithName('child')
+        self.assertEquals(type(node.xmlrepr(child, holder)), unicode)
+        self.assertEquals(node.xmlrepr(child, holder),
+                          u''.join(node.iterXmlRepr(child, holder)))
+        xml = holder.toXml()
+        self.assertEquals(type(xml), str)
+        self.assertEquals(xml.count(self.norwegian_latin1), 2)
+        self.assertEquals(Latin1Holder.fromXml(xml), holder)
+
 
 class GetSetTest(unittest.TestCase):
 
@@ -199,6 +226,11 @@ class GetSetTest(unittest.TestCase):
         self.assertRaises(TypeError, setattr, self.obj, 'position', 'not a number')
         self.assertRaises(TypeError, setattr, self.obj, 'record', 2)
 
+    def testGetItem(self):
+        self.assertEqual(self.obj['position'], 1)
+        self.assertEqual(self.obj['record'], 'AB1')
+        self.assertRaises(AttributeError, self.obj.__getitem__, 'missing')
+
     def testNewAttrs(self):
         self.obj.cdataAttr = 'ok1'
         self.obj.nmTok = 'some_data:'
@@ -246,6 +278,22 @@ class GetSetTest2(unittest.TestCase):
         self.obj.items = [ it ]
         self.assertEqual(self.obj.items[0], it)
 
+    def testExtendList(self):
+        self.assertRaises(TypeError, self.obj.items.extend, [ Item(), 'text' ])
+        self.assertEqual(len(self.obj.items), self.itemsNb)
+        self.obj.items.extend([ Item(position=i) for i in range(3) ])
+        self.assertEqual(len(self.obj.items), self.itemsNb + 3)
+
+        # the accepted class is looked up again once redefined
+        class Thing(XMLObject): pass
+        class Holder(XMLObject):
+            things = ListNode('Thing')
+        holder = Holder()
+        holder.things.append(Thing())
+        class Thing(XMLObject): pass
+        holder.things.append(Thing())
+        self.assertRaises(TypeError, holder.things.append, Item())
+
 
 class ForEachTest(GetSetTest2):
 
@@ -259,6 +307,347 @@ class ForEachTest(GetSetTest2):
         self.assertEqual(len(self.positions), len(self.obj.items))
         self.assertEqual(self.positions, self.defaultPositions)
 
+    def testWalk(self):
+        paths = [ path for node, xmlObject, depth, path in self.obj.walk()
+                  if node.getName() == 'position' ]
+        self.assertEqual(paths, [ ('items', i, 'position')
+                                  for i in self.defaultPositions ])
+        entries = list(self.obj.walk(postOrder=True))
+        paths = [ path for node, xmlObject, depth, path in entries ]
+        self.assert_(paths.index(('items',)) > paths.index(('items', 9, 'position')))
+        self.assertEqual(sorted(entries), sorted(self.obj.walk()))
+        pruned = self.obj.walk(prune=lambda node, *rest: node.getName() == 'items')
+        self.assertEqual(max([ depth for node, xo, depth, path in pruned ]), 0)
+
+    def testWalkDeep(self):
+        class Nest(XMLObject):
+            child = ItemNode('Nest', optional=True)
+        nest = Nest()
+        for i in range(sys.getrecursionlimit()):
+            nest = Nest(child=nest)
+        depths = [ depth for node, xmlObject, depth, path in nest.walk() ]
+        self.assertEqual(depths[-1], sys.getrecursionlimit())
+
+class StreamTest(GetSetTest2):
+
+    def testWriteXml(self):
+        out = StringIO()
+        self.obj.writeXml(out)
+        self.assertEqual(out.getvalue(), self.obj.toXml())
+
+    def testWriteXmlChunks(self):
+        out = StringIO()
+        self.obj.writeXml(out, prettyPrint=False, chunkSize=16)
+        self.assertEqual(out.getvalue(), self.obj.toXml(prettyPrint=False))
+
+    def testIterXml(self):
+        chunks = self.obj.iterXml(chunkSize=16, prettyPrint=False)
+        first = chunks.next()
+        self.assert_(first.startswith('<?xml'))
+        rest = list(chunks)
+        self.assert_(len(rest) > 1)
+        self.assertEqual(first + ''.join(rest), self.obj.toXml(prettyPrint=False))
+
+    def testIterXmlPretty(self):
+        chunks = list(self.obj.iterXml(chunkSize=16))
+        self.assert_(len(chunks) > 1)
+        self.assertEqual(''.join(chunks), self.obj.toXml())
+
+class SerializerTest(unittest.TestCase):
+
+    def testCompiledOnce(self):
+        class Compiled(XMLObject):
+            title = StringAttribute()
+
+        class SubCompiled(Compiled):
+            _name = 'sub'
+
+        self.assertEqual(Compiled.__serializer__, None)
+        self.assertEqual(Compiled(title='a').toXml(headers=0, prettyPrint=False),
+                         '<Compiled title="a"/>')
+        serializer = Compiled.__serializer__
+        self.assertNotEqual(serializer, None)
+        Compiled(title='b').toXml(prettyPrint=False)
+        self.assert_(Compiled.__serializer__ is serializer)
+        self.assertEqual(SubCompiled.toXml(SubCompiled(title='c'), headers=0,
+                                           prettyPrint=False),
+                         '<sub title="c"/>')
+        self.assert_(SubCompiled.__serializer__ is not serializer)
+
+        self.assertEqual(Compiled.__prettySerializer__, None)
+        Compiled(title='d').toXml()
+        serializer = Compiled.__prettySerializer__
+        self.assertNotEqual(serializer, None)
+        Compiled(title='e').toXml()
+        self.assert_(Compiled.__prettySerializer__ is serializer)
+
+    def testUndeclaredOrder(self):
+        class Ordered(XMLObject):
+            _attrsOrder = [ 'b', 'missing', 'a' ]
+            _nodesOrder = [ 'missing', 'text' ]
+            a = StringAttribute()
+            b = StringAttribute()
+            text = TextNode()
+        ordered = Ordered(a='1', b='2', text='t')
+        self.assertEqual(ordered.toXml(headers=0, prettyPrint=False),
+                         '<Ordered b="2" a="1"><text>t</text></Ordered>')
+
+    def testMainNode(self):
+        class Loud(XMLObject):
+            _prettyPrint = False
+            text = UpperTextNode(main=True)
+
+        loud = Loud(text=u'one\ntwo')
+        self.assertEqual(loud.toXml(headers=0), '<Loud>ONE\nTWO</Loud>')
+        node = loud.getNodeWithName('text')
+        self.assertEqual(TextNode.xmlrepr(node, u'a', loud), u'a')
+        self.assertEqual(TextNode.xmlrepr(node, u'a', loud, unwrapped=False),
+                         u'<text>a</text>')
+
+    def testPrettyPrint(self):
+        from EaseXML3.PrettyXMLPrinter import PrettyXMLPrinter
+        printer = PrettyXMLPrinter()
+        playlist = Playlist(name='foo', comment='blah', title='2004')
+        for i in range(3):
+            playlist.items.append(Item(position=i, record='r', content=' %d ' % i,
+                                       dummyData='<raw>'))
+        class PrettyMix(XMLObject):
+            mix = ChoiceNode(['#PCDATA', 'Shout'], noLimit=True, main=True)
+        mix = PrettyMix()
+        for value in (u'text ', Shout(text='a <b>'), u'', u'more text'):
+            mix.mix.append(value)
+        for xmlObject in (playlist, mix):
+            for headers in (0, 1):
+                xml = xmlObject.toXml(headers=headers, prettyPrint=False)
+                self.assertEqual(xmlObject.toXml(headers=headers, prettyPrint=True),
+                                 printer.prettyPrint(xml, indent='  '))
+
+class UpperTextNode(TextNode):
+    """ TextNode subclass, rendered through `Node.iterXmlRepr`. """
+
+    def xmlrepr(self, value, parentInstance=None):
+        return TextNode.xmlrepr(self, value and value.upper(), parentInstance)
+
+class Shout(XMLObject):
+    _prettyPrint = False
+    text = UpperTextNode()
+    others = ListNode('Shout')
+
+class ThreadingTest(unittest.TestCase):
+
+    def runThreads(self, func, threadsNb=4):
+        errors = []
+        def run(i):
+            try:
+                func(i)
+            except Exception as ex:
+                errors.append(ex)
+        threads = [ threading.Thread(target=run, args=(i,))
+                    for i in range(threadsNb) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def testConcurrentToXml(self):
+        def serialize(i):
+            shout = Shout(text='shout %d' % i)
+            expected = '<Shout><text>SHOUT %d</text></Shout>' % i
+            for j in range(300):
+                xml = shout.toXml(headers=0)
+                if xml != expected:
+                    raise AssertionError(xml)
+        self.runThreads(serialize)
+
+    def testConcurrentInit(self):
+        lists = []
+        def build(i):
+            for j in range(300):
+                lists.append(Shout().others)
+        self.runThreads(build)
+        self.assertEqual(len(set(map(id, lists))), len(lists))
+
+    def testConcurrentPrettyPrint(self):
+        def serialize(i):
+            root = Root()
+            for j in range(i + 1):
+                root.children.append(OneDeep())
+                root.children[-1].children.append(TwoDeep())
+            expected = root.toXml()
+            for j in range(50):
+                xml = root.toXml()
+                if xml != expected:
+                    raise AssertionError(xml)
+        self.runThreads(serialize)
+
+class LightweightInitTest(unittest.TestCase):
+
+    def testNewEmpty(self):
+        playlist = Playlist._newEmpty()
+        self.assertEqual(playlist._attributes, {})
+        self.assertEqual(playlist.items, None)
+        self.assert_(playlist.getParentNode() is Playlist().getParentNode())
+        self.assert_('_prettyPrinter' not in Playlist().__dict__)
+
+    def testParsedParents(self):
+        playlist = Playlist(name='foo', type='xml')
+        playlist.items.append(Item(position=1, record='r', content='c'))
+        parsed = Playlist.fromXml(playlist.toXml())
+        self.assertEqual(parsed, playlist)
+        self.assertEqual(parsed.items[0].getParentNode(),
+                         playlist.items[0].getParentNode())
+
+    def testInitHook(self):
+        # `_init` runs once the Node values are set
+        playlist = CountedPlaylist(name='foo', type='xml')
+        playlist.items.append(Item(position=1, record='r', content='c'))
+        self.assertEqual(playlist.count, 0)
+        for parser in ('dom', 'expat'):
+            parsed = CountedPlaylist.fromXml(playlist.toXml(), parser)
+            self.assertEqual(parsed.count, 1)
+        self.assertEqual(pickle.loads(pickle.dumps(playlist)).count, 0)
+        del playlist.count
+        self.assertEqual(copy.deepcopy(playlist).count, 1)
+
+class CountedPlaylist(Playlist):
+
+    def _init(self):
+        self.count = len(self.items)
+
+class CompactItem(XMLObject):
+    _compact = True
+    position = IntegerAttribute()
+    content = TextNode(name='item-content', optional=True)
+
+class CompactList(XMLObject):
+    _compact = True
+    name = StringAttribute()
+    items = ListNode('CompactItem')
+
+class CompactSubList(CompactList):
+    title = TextNode(optional=True)
+
+class CompactTest(unittest.TestCase):
+
+    def setUp(self):
+        self.obj = CompactList(name='foo')
+        for i in range(3):
+            self.obj.items.append(CompactItem(position=i, content=str(i)))
+
+    def testNotCompactSubclass(self):
+        def subclass():
+            class NotCompactList(CompactList):
+                _compact = False
+        self.assertRaises(TypeError, subclass)
+
+    def testSlots(self):
+        self.failIf(hasattr(self.obj, '__dict__'))
+        self.failIf(hasattr(self.obj.items[0], '__dict__'))
+        self.assertRaises(AttributeError, setattr, self.obj, 'foo', 1)
+        self.assertEqual(self.obj.items[1].content, '1')
+        self.assertEqual(self.obj.items[1].get('_XO_item-content'), '1')
+
+    def testExportImport(self):
+        xml = self.obj.toXml()
+        self.assertEqual(xml.count('<item-content>'), 3)
+        for parser in ('dom', 'expat'):
+            self.assertEqual(CompactList.fromXml(xml, parser=parser), self.obj)
+
+    def testInheritance(self):
+        sub = CompactSubList(name='bar', title='baz')
+        sub.items.append(CompactItem(position=0))
+        self.failIf(hasattr(sub, '__dict__'))
+        self.assertEqual(CompactSubList.__slots__, ('_XO_title',))
+        self.assertEqual(CompactSubList.fromXml(sub.toXml()), sub)
+
+class PickleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.playlist = Playlist(name='foo', type='xml', comment='blah')
+        for i in range(3):
+            self.playlist.items.append(Item(position=i, record='r%d' % i,
+                                            content=str(i), dummyData='<raw>'))
+
+    def checkParents(self, playlist):
+        node = playlist.getNodeWithName('items')
+        self.assert_(playlist.items._owner is playlist)
+        self.assert_(playlist.items._xmlList is node)
+        for item in playlist.items:
+            self.assert_(item.getParentNode() is node)
+
+    def testRoundTrip(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            data = pickle.dumps(self.playlist, protocol)
+            self.failIf('_parentNode' in data or 'xmlProcessingInstruction' in data)
+            playlist = pickle.loads(data)
+            self.assertEqual(playlist, self.playlist)
+            self.assertEqual(playlist.toXml(), self.playlist.toXml())
+            self.checkParents(playlist)
+            self.assertRaises(TypeError, playlist.items.append, Playlist())
+
+    def testCopy(self):
+        playlist = copy.deepcopy(self.playlist)
+        self.assertEqual(playlist, self.playlist)
+        self.checkParents(playlist)
+        self.failIf(playlist.items[0] is self.playlist.items[0])
+        playlist = copy.copy(self.playlist)
+        self.failIf(playlist.items is self.playlist.items)
+        self.assert_(playlist.items[0] is self.playlist.items[0])
+
+    def testShallowCopy(self):
+        class Cover(XMLObject):
+            title = TextNode()
+        class Album(XMLObject):
+            cover = ItemNode('Cover')
+        album = Album(cover=Cover(title='foo'))
+        album.extra = ['kept']
+        copied = copy.copy(album)
+        self.assert_(copied.cover is album.cover)
+        self.assert_(album.cover.getParentNode() is album)
+        self.assert_(copied.extra is album.extra)
+        copied = copy.deepcopy(album)
+        self.assert_(copied.cover.getParentNode() is copied)
+        self.assertEqual(copied.extra, album.extra)
+        self.failIf(copied.extra is album.extra)
+        self.playlist.extra = 'kept'
+        playlist = pickle.loads(pickle.dumps(self.playlist))
+        self.assertEqual(playlist.extra, 'kept')
+
+    def testCompact(self):
+        compact = CompactSubList(name='bar', title='baz')
+        compact.items.append(CompactItem(position=0, content='c'))
+        data = pickle.dumps(compact, pickle.HIGHEST_PROTOCOL)
+        self.assertEqual(pickle.loads(data), compact)
+        self.assertEqual(pickle.loads(data).items[0].getParentNode(),
+                         compact.items[0].getParentNode())
+
+class UtilsTest(unittest.TestCase):
+
+    def testGroupChildrenByName(self):
+        from xml.dom.minidom import parseString
+        from EaseXML3 import utils
+        dom = parseString('<a><b/>text<c/><b x="1"/><!-- c --></a>').documentElement
+        children = utils.groupChildrenByName(dom)
+        self.assertEqual(sorted(children.keys()), ['b', 'c'])
+        self.assertEqual([ b.getAttribute('x') for b in children['b'] ], ['', '1'])
+        for name in ('b', 'c', 'd'):
+            self.assertEqual(utils.getDirectChildrenWithName(dom, name, children),
+                             utils.getDirectChildrenWithName(dom, name))
+
+class PrettyPrinterTest(unittest.TestCase):
+
+    def testIterPrettyPrint(self):
+        from EaseXML3.PrettyXMLPrinter import PrettyXMLPrinter, NotWellFormedXML
+        printer = PrettyXMLPrinter()
+        xml = '<a x="1"><!-- c --><b>text</b><c/><![CDATA[<d>]]></a>'
+        lines = list(printer.iterPrettyPrint(xml, indent='  '))
+        self.assertEqual(lines, ['<a x="1">\n', '  <!--c-->\n', '  <b>\n',
+                                 '      text\n', '  </b>\n', '  <c/>\n',
+                                 '  <![CDATA[<d>]]>\n', '</a>\n'])
+        self.assertEqual(printer.prettyPrint(xml, indent='  '), ''.join(lines)[:-1])
+        self.assertRaises(NotWellFormedXML, printer.prettyPrint, '<a><b></a></b>')
+
 class NewNameTest(unittest.TestCase):
 
     def testCorrectNaming(self):
@@ -336,6 +725,242 @@ class DeepDictImportExportTest(GetSetTest2, ImportExport):
                          for i in GetSetTest2.defaultPositions ],
                'type': 'xml', 'name': 'foo'}
 
+    def testExportEqualItems(self):
+        self.obj.items.append(Item(position=0, content='0'*5))
+        items = self.obj.toDict()['items']
+        self.assertEqual(len(items), self.itemsNb + 1)
+        self.assertEqual(items[0], items[-1])
+
+class EqualityTest(unittest.TestCase):
+
+    def makePlaylist(self, name='foo'):
+        playlist = Playlist(name=name, type='xml', comment='blah')
+        for i in range(3):
+            playlist.items.append(Item(position=i, record='r', content='%d ' % i))
+        return playlist
+
+    def testEqual(self):
+        playlist = self.makePlaylist()
+        self.assertEqual(playlist, self.makePlaylist())
+        self.assertEqual(playlist, Playlist.fromXml(playlist.toXml()))
+        self.assertNotEqual(playlist, self.makePlaylist(name='bar'))
+        other = self.makePlaylist()
+        other.items[2].position = 5
+        self.assertNotEqual(playlist, other)
+        del other.items[2]
+        self.assertNotEqual(playlist, other)
+        self.assertRaises(TypeError, playlist.__eq__, 'foo')
+
+    def testHash(self):
+        playlists = set([ self.makePlaylist(), self.makePlaylist(),
+                          self.makePlaylist(name='bar') ])
+        self.assertEqual(len(playlists), 2)
+        playlist = self.makePlaylist()
+        self.assert_(playlist in playlists)
+        parsed = Playlist.fromXml(playlist.toXml())
+        self.assertEqual(hash(parsed), playlist.fingerprint())
+        self.assertEqual({playlist: 1}[parsed], 1)
+
+        # cached fingerprints are dropped on modification
+        fingerprint = playlist.fingerprint()
+        self.assertEqual(playlist.fingerprint(), fingerprint)
+        playlist.items[0].content = 'changed'
+        self.assertNotEqual(playlist.fingerprint(), fingerprint)
+        playlist.items[0].content = '0'
+        self.assertEqual(playlist.fingerprint(), fingerprint)
+        playlist.items.pop()
+        self.assertNotEqual(playlist.fingerprint(), fingerprint)
+
+    def testCachedFingerprint(self):
+        class HashedPoint(XMLObject):
+            _cacheFingerprint = True
+            x = IntegerAttribute()
+        class HashedBag(XMLObject):
+            _cacheFingerprint = True
+            point = ItemNode('HashedPoint')
+        point = HashedPoint(x=1)
+        bags = [ HashedBag(point=point), HashedBag(point=point) ]
+        for bag in bags:
+            self.assertEqual(bag._getCachedFingerprint(), None)
+            fingerprint = bag.fingerprint()
+            self.assertEqual(bag._getCachedFingerprint(), fingerprint)
+        # both holders of the modified point drop their fingerprint
+        point.x = 2
+        fresh = HashedBag(point=HashedPoint(x=2))
+        for bag in bags:
+            self.assertEqual(bag, fresh)
+            self.assertEqual(hash(bag), hash(fresh))
+            self.assert_(bag in set([ fresh ]))
+        # not cached by default
+        playlist = self.makePlaylist()
+        playlist.fingerprint()
+        self.assertEqual(playlist._getCachedFingerprint(), None)
+
+    def testWhitespace(self):
+        # text is stripped on import, comments and CDATA aren't
+        playlist = self.makePlaylist()
+        other = self.makePlaylist()
+        other.items[0].content = ' 0'
+        self.assertEqual(playlist, other)
+        self.assertEqual(playlist.fingerprint(), other.fingerprint())
+        other.comment = ' blah'
+        self.assertNotEqual(playlist, other)
+        other = self.makePlaylist()
+        playlist.items[0].dummyData = 'a'
+        other.items[0].dummyData = ' a'
+        self.assertNotEqual(playlist, other)
+
+class SelfNestingTest(unittest.TestCase):
+
+    def setUp(self):
+        class Directory(XMLObject):
+            name = StringAttribute()
+            subdirs = ListNode('Directory', optional=True)
+        self.klass = Directory
+
+    def testShared(self):
+        root = self.klass(name='root')
+        sub = self.klass(name='sub')
+        root.subdirs.append(sub)
+        self.assert_(root.subdirs[0] is sub)
+        leaf = self.klass(name='leaf')
+        sub.subdirs.append(leaf)
+        self.assert_(root.subdirs[0].subdirs[0] is leaf)
+
+    def testCycle(self):
+        root = self.klass(name='root')
+        root.subdirs.append(root)
+        self.assert_(root.subdirs[0] is not root)
+        self.assertEqual(root.toXml(headers=0, prettyPrint=False),
+                         '<Directory name="root"><Directory name="root"/></Directory>')
+
+        sub = self.klass(name='sub')
+        root.subdirs = [ sub ]
+        sub.subdirs.append(root)
+        self.assert_(sub.subdirs[0] is not root)
+        self.assertEqual(root.toXml(headers=0, prettyPrint=False),
+                         '<Directory name="root"><Directory name="sub">'
+                         '<Directory name="root"><Directory name="sub"/>'
+                         '</Directory></Directory></Directory>')
+        sub.subdirs = [ root ]
+        self.assert_(sub.subdirs[0] is not root)
+
+    def testDeepCycle(self):
+        root = self.klass(name='root')
+        parent = root
+        for i in range(5):
+            sub = self.klass(name='sub%d' % i)
+            parent.subdirs.append(sub)
+            parent = sub
+        # found walking up from the deepest Directory
+        sub.subdirs.append(root)
+        self.assert_(sub.subdirs[0] is not root)
+        other = self.klass(name='other')
+        sub.subdirs.append(other)
+        self.assert_(sub.subdirs[1] is other)
+        # stored by an XMLObject outside of the tree afterwards
+        shared = self.klass(name='shared')
+        shared.subdirs.append(self.klass(name='leaf'))
+        root.subdirs.append(shared)
+        self.klass(name='top').subdirs.append(shared)
+        shared.subdirs[0].subdirs.append(root)
+        self.assert_(shared.subdirs[0].subdirs[0] is not root)
+
+    def testCycleByIndex(self):
+        root = self.klass(name='root')
+        sub = self.klass(name='sub')
+        root.subdirs.append(sub)
+        sub.subdirs.append(self.klass(name='leaf'))
+        sub.subdirs[0] = root
+        self.assert_(sub.subdirs[0] is not root)
+        self.assert_(sub.subdirs[0].getParentNode() is
+                     sub.getNodeWithName('subdirs'))
+        self.assertEqual(root.toXml(headers=0, prettyPrint=False),
+                         '<Directory name="root"><Directory name="sub">'
+                         '<Directory name="root"><Directory name="sub">'
+                         '<Directory name="leaf"/></Directory></Directory>'
+                         '</Directory></Directory>')
+        sub.subdirs[0:1] = [ root ]
+        self.assert_(sub.subdirs[0] is not root)
+        sub.subdirs[::1] = [ root ]
+        self.assert_(sub.subdirs[0] is not root)
+        self.assertRaises(TypeError, sub.subdirs.__setitem__, 0, 'text')
+
+class XmlCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        class Entry(XMLObject):
+            _cacheXml = True
+            title = TextNode()
+        class Feed(XMLObject):
+            _cacheXml = True
+            name = StringAttribute()
+            entries = ListNode('Entry')
+        self.feed = Feed(name='feed')
+        for i in range(3):
+            self.feed.entries.append(Entry(title='entry %d' % i))
+
+    def checkXml(self):
+        for prettyPrint in (True, False):
+            xml = self.feed.toXml(prettyPrint=prettyPrint)
+            self.assertEqual(xml, self.feed.toXml(prettyPrint=prettyPrint))
+            # same as without cache
+            self.feed.__class__._cacheXml = False
+            self.assertEqual(xml, self.feed.toXml(prettyPrint=prettyPrint))
+            self.feed.__class__._cacheXml = True
+
+    def testCache(self):
+        Feed, Entry = self.feed.__class__, self.feed.entries[0].__class__
+        self.checkXml()
+        # the second renderings hit the Feed cache
+        self.assertEqual(Feed.getXmlCacheStats(), {'hits': 2, 'misses': 2})
+
+        # only the modified Entry is rendered again
+        self.feed.entries[1].title = 'changed'
+        before = Entry.getXmlCacheStats()
+        self.assert_('changed' in self.feed.toXml(prettyPrint=False))
+        after = Entry.getXmlCacheStats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 2)
+        self.checkXml()
+
+        for change in (lambda: self.feed.entries.append(Entry(title='new')),
+                       lambda: self.feed.entries.pop(0),
+                       lambda: setattr(self.feed, 'name', 'renamed')):
+            xml = self.feed.toXml()
+            change()
+            self.assertNotEqual(self.feed.toXml(), xml)
+            self.checkXml()
+
+    def testOtherTree(self):
+        Feed, Entry = self.feed.__class__, self.feed.entries[0].__class__
+        other = Feed(name='other', entries=[ Entry(title='other') ])
+        xml = self.feed.toXml()
+        other.toXml()
+        # modifying another tree keeps the cached XML data
+        other.entries[0].title = 'changed'
+        before = Feed.getXmlCacheStats()
+        self.assertEqual(self.feed.toXml(), xml)
+        after = Feed.getXmlCacheStats()
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assert_('changed' in other.toXml())
+
+    def testSharedEntry(self):
+        Feed, Entry = self.feed.__class__, self.feed.entries[0].__class__
+        entry = Entry(title='shared')
+        feeds = [ self.feed, Feed(name='other') ]
+        for feed in feeds:
+            feed.entries.append(entry)
+            feed.toXml()
+        # every Feed storing the Entry gets rendered again
+        entry.title = 'changed'
+        for feed in feeds:
+            self.assert_('changed' in feed.toXml())
+        copied = copy.copy(self.feed)
+        copied.toXml()
+        entry.title = 'copied'
+        self.assert_('copied' in copied.toXml())
+
 class InheritanceTest(unittest.TestCase):
 
     def checkDataForInstance(self, instance, data):
@@ -467,6 +1092,28 @@ class TestChoice(unittest.TestCase):
         b2 = Blah.fromXml(b1.toXml())
         self.assertEqual(b1,b2)
 
+    def testAlternativeClasses(self):
+        class Counted(XMLObject):
+            instances = [0]
+            def _init(self):
+                self.instances[0] += 1
+
+        class NotCounted(XMLObject):
+            pass
+
+        class Mixed(XMLObject):
+            content = ChoiceNode(['#PCDATA', 'NotCounted', 'Counted'],
+                                 noLimit=True, main=True)
+
+        mixed = Mixed.fromXml('<Mixed>a<NotCounted/><Counted/>b<Counted/></Mixed>')
+        self.assertEqual(Counted.instances, [2])
+        self.assertEqual([ getattr(item, 'getName', lambda: item)()
+                           for item in mixed.content ],
+                         ['a', 'NotCounted', 'Counted', 'b', 'Counted'])
+        node = Mixed.__nodes__['content']
+        self.assertEqual(node.getAlternativeClasses(Mixed._registry),
+                         {'NotCounted': [NotCounted], 'Counted': [Counted]})
+
 class XXX(XMLObject):
     """
     <!ELEMENT XXX (AAA+ , BBB+)>
@@ -544,6 +1191,132 @@ class TestChoiceListRaw(unittest.TestCase):
         bb.append(CCC('Foo'))
         self.assertEqual(len(bb.content), 2)
 
+class UnpicklableError(Exception):
+
+    def __init__(self, reason, detail):
+        # `detail` isn't kept in `args`: unpickling fails
+        Exception.__init__(self, reason)
+
+class Faulty(XMLObject):
+    title = TextNode(optional=True)
+
+    def _init(self):
+        raise UnpicklableError('faulty', self)
+
+class ExpatParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.playlist = Playlist(name='foo', type='xml', comment='blah blah')
+        for i in range(3):
+            self.playlist.items.append(Item(position=i, record='r%d' % i,
+                                            content=str(i)*5, dummyData='<%d>' % i))
+
+    def parseBoth(self, klass, xml):
+        fromDom = klass.fromXml(xml, parser='dom')
+        fromExpat = klass.fromXml(xml, parser='expat')
+        self.assertEqual(fromExpat, fromDom)
+        self.assertEqual(fromExpat.toXml(), fromDom.toXml())
+        return fromExpat
+
+    def testPlaylist(self):
+        pl = self.parseBoth(Playlist, self.playlist.toXml())
+        self.assertEqual(pl, self.playlist)
+        self.assertEqual(pl.items[2].content, '22222')
+
+    def testChoiceListRaw(self):
+        xxx = TestChoiceListRaw('testXXX')
+        xxx.setUp()
+        self.parseBoth(XXX, xxx.xxx.toXml())
+        self.parseBoth(XXX, xxx.xxx.toXml(prettyPrint=False))
+
+    def testFileLike(self):
+        pl = Playlist.fromXml(StringIO(self.playlist.toXml()), parser='expat')
+        self.assertEqual(pl, self.playlist)
+
+    def testDefaultParser(self):
+        Playlist._parser = 'expat'
+        try:
+            pl = Playlist.fromXml(self.playlist.toXml())
+        finally:
+            del Playlist._parser
+        self.assertEqual(pl, self.playlist)
+        self.assertRaises(ValueError, Playlist.fromXml, '<Playlist/>', 'sax')
+
+    def testIterFromXml(self):
+        xml = self.playlist.toXml()
+        items = list(Playlist.iterFromXml(xml, 'items', chunkSize=16))
+        self.assertEqual(items, list(self.playlist.items))
+        items = Playlist.iterFromXml(StringIO(xml), 'items', chunkSize=16)
+        self.assertEqual(list(items), list(self.playlist.items))
+
+    def testIterFromXmlPath(self):
+        class ArchiveChannel(XMLObject):
+            title = TextNode()
+            entries = ListNode('Item', optional=True)
+
+        class Archive(XMLObject):
+            channel = ItemNode('ArchiveChannel')
+
+        archive = Archive(channel=ArchiveChannel(title='foo'))
+        archive.channel.entries = list(self.playlist.items)
+        entries = Archive.iterFromXml(archive.toXml(), 'channel/entries')
+        self.assertEqual(list(entries), list(self.playlist.items))
+
+        root = Root()
+        for i in range(3):
+            one = OneDeep()
+            one.children.append(TwoDeep())
+            root.children.append(one)
+        twos = list(Root.iterFromXml(str(root), 'children/children'))
+        self.assertEqual(len(twos), 3)
+        self.assertEqual(str(twos[0]), '<TwoDeep/>')
+
+        self.assertRaises(ValueError, Archive.iterFromXml, '', 'channel')
+        self.assertRaises(ValueError, Archive.iterFromXml, '', 'channel/title')
+        self.assertRaises(ValueError, Archive.iterFromXml, '', 'foo')
+
+    def testErrors(self):
+        self.assertRaises(ParseError, Playlist.fromXml, '<Playlist>', 'expat')
+        self.assertRaises(ParseError, list,
+                          Playlist.iterFromXml('<Playlist>', 'items'))
+        self.assertRaises(RequiredNodeError, Playlist.fromXml,
+                          '<Playlist type="xml"/>', 'expat')
+
+    def testFromXmlMany(self):
+        documents = []
+        for i in range(6):
+            self.playlist.name = 'p%d' % i
+            documents.append(self.playlist.toXml())
+        documents[2] = '<Playlist>'
+        documents[4] = '<Playlist type="xml"/>'
+        documents[5] = documents[5].replace('position="0"', 'position="x"')
+        for workers in (1, 2):
+            results = list(Playlist.fromXmlMany(documents, workers=workers,
+                                                parser='expat'))
+            self.assertEqual([ index for index, result in results ], range(6))
+            self.assert_(isinstance(results[2][1], ParseError))
+            self.assert_(isinstance(results[4][1], RequiredNodeError))
+            self.assert_(isinstance(results[5][1], ValueError))
+            for i in (0, 1, 3):
+                self.assertEqual(results[i][1].toXml(), documents[i])
+        results = Playlist.fromXmlMany(documents, workers=2, chunkSize=2,
+                                       ordered=False)
+        self.assertEqual(sorted([ (index, str(result))
+                                  for index, result in results ]),
+                         [ (i, str(result)) for i, result in
+                           Playlist.fromXmlMany(documents, workers=1) ])
+
+    def testFromXmlManyUnpicklable(self):
+        # errors which can't be pickled back are wrapped
+        for workers in (1, 2):
+            results = list(Faulty.fromXmlMany([ '<Faulty/>' ] * 2,
+                                              workers=workers))
+            for index, result in results:
+                self.assert_(isinstance(result, ParseError))
+                self.assert_('UnpicklableError' in str(result))
+        error = LeftRecursionError('left')
+        self.assertEqual(str(pickle.loads(pickle.dumps(error))), 'left')
+
 class EntitiesTest(unittest.TestCase):
 
     def testQuote(self):
@@ -556,6 +1329,15 @@ class EntitiesTest(unittest.TestCase):
         self.assertEqual(q.toXml(headers=0), expected)
         self.assertEqual(QuoteTest.fromXml(expected).title, 'some " quote Bar')
 
+    def testGetEntities(self):
+        class Override(XMLObject):
+            title = StringAttribute()
+
+            def getEntities(self):
+                return [ ('&bar;', 'Baz') ] + XMLObject.getEntities(self)
+        self.assertEqual(Override(title='&bar; &').toXml(headers=0),
+                         '<Override title="Baz &amp;"/>')
+
     def testText(self):
         class Text(XMLObject):
             content = RawNode()
@@ -567,6 +1349,20 @@ class EntitiesTest(unittest.TestCase):
 </Text>"""
         self.assertEqual(t.toXml(headers=0), expected)
 
+    def testEscaper(self):
+        class Escaped(XMLObject):
+            _entities = [ ('&foo;', 'Bar & <Baz>') ]
+            title = TextNode()
+
+        plain = u'nothing to escape'
+        self.assert_(Escaped.__escaper__(plain) is plain)
+        self.assertEqual(Escaped.__escaper__(None), '')
+        self.assertEqual(Escaped.__escaper__(u'&foo; <'),
+                         u'Bar &amp; &lt;Baz&gt; &lt;')
+        self.assertEqual(Escaped(title='&foo;').toXml(headers=0, prettyPrint=False),
+                         '<Escaped><title>Bar &amp; &lt;Baz&gt;</title></Escaped>')
+        self.assertEqual(Playlist.__escaper__(u'"&foo;"'), u'&quot;&amp;foo;&quot;')
+
 
 class A(XMLObject):
     name = TextNode()
@@ -707,6 +1503,29 @@ class ExoWebTests(unittest.TestCase):
         self.assert_(isinstance(restored_xml_object, Sample2))
         self.assertEqual('jacob', restored_xml_object.name)
 
+    def testSmartFromXMLUnicode(self):
+        class Sample3(XMLObject):
+            _encoding = 'iso-8859-1'
+            name = StringAttribute()
+
+        xml = Sample3(name = u'j\xe9r\xf4me').toXml().decode('iso-8859-1')
+        restored_xml_object = XMLObject.instanceFromXml(xml)
+        self.assert_(isinstance(restored_xml_object, Sample3))
+        self.assertEqual(u'j\xe9r\xf4me', restored_xml_object.name)
+        self.assertRaises(ParseError, XMLObject.instanceFromXml, '<unknownElement/>')
+        self.assertRaises(ParseError, XMLObject.instanceFromXml, u'<unknownElement/>')
+
+    def testSmartFromXMLRedefined(self):
+        class Sample4(XMLObject):
+            _name = 'sample4Old'
+
+        class Sample4(XMLObject):
+            _name = 'sample4New'
+
+        registry = classregistry.registry(XMLObject._registry)
+        self.assertRaises(KeyError, registry.getClassForElement, 'sample4Old')
+        self.assert_(isinstance(XMLObject.instanceFromXml('<sample4New/>'), Sample4))
+
 
 
 class StripTest(unittest.TestCase):